@@ -11,16 +11,53 @@ Sinograms then reconstructed using tomobar using different data fidelities
 1. ASTRA toolbox: conda install -c astra-toolbox astra-toolbox
 2. tomobar: conda install -c dkazanc tomobar
 or install from https://github.com/dkazanc/tomobar
+3. CuPy (optional, to keep FISTA iterations on the GPU): conda install -c conda-forge cupy
 
 This demo demonstrates frequent inaccuracies which are accosiated with X-ray imaging:
 zingers, rings and noise
+The figures are saved as out_*.png files, run with TOMOBAR_DEMO_SHOW=1 to display them instead
 """
+import os
+import hashlib
+import itertools
 import numpy as np
+import matplotlib
+# the figures are saved to PNG files unless TOMOBAR_DEMO_SHOW=1 is set
+INTERACTIVE = os.environ.get('TOMOBAR_DEMO_SHOW', '0') == '1'
+if not INTERACTIVE:
+    matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from tomophantom import TomoP2D
-import os
 import tomophantom
-from tomophantom.supp.qualitymetrics import QualityTools
+
+def rmse(im1, im2):
+    # root mean square error, the squared sum is a single dot product
+    d = (im1.astype(np.float32, copy=False) - im2.astype(np.float32, copy=False)).ravel()
+    return float(np.sqrt(np.einsum('i,i->', d, d)/d.size))
+
+figure_counter = itertools.count(1)
+
+def show_figures():
+    # shows the figures (interactive mode) or saves and closes them
+    if INTERACTIVE:
+        plt.show()
+    else:
+        for num in plt.get_fignums():
+            plt.figure(num).savefig('out_{}.png'.format(next(figure_counter)), dpi=100)
+        plt.close('all')
+
+def _cached(name, params, compute):
+    # the phantom and its sinogram are deterministic, keep them on disk for reruns
+    key = hashlib.blake2b(repr((name, params)).encode(), digest_size=16).hexdigest()
+    cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'tomobar')
+    filename = os.path.join(cache_dir, key + '.npz')
+    if os.path.isfile(filename):
+        with np.load(filename) as cached:
+            return cached['data']
+    data = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez_compressed(filename, data=data)
+    return data
 
 model = 12 # select a model
 N_size = 512 # set dimension of the phantom
@@ -28,7 +65,7 @@ N_size = 512 # set dimension of the phantom
 # path_library2D = '../../../PhantomLibrary/models/Phantom2DLibrary.dat'
 path = os.path.dirname(tomophantom.__file__)
 path_library2D = os.path.join(path, "Phantom2DLibrary.dat")
-phantom_2D = TomoP2D.Model(model, N_size, path_library2D)
+phantom_2D = _cached('p2d', (model, N_size), lambda: TomoP2D.Model(model, N_size, path_library2D))
 
 plt.close('all')
 plt.figure(1)
@@ -43,7 +80,7 @@ angles = np.linspace(0.0,179.9,angles_num,dtype='float32')
 angles_rad = angles*(np.pi/180.0)
 P = N_size #int(np.sqrt(2)*N_size) #detectors
 
-sino_an = TomoP2D.ModelSino(model, N_size, P, angles, path_library2D)
+sino_an = _cached('sino_an', (model, N_size, P, angles.tolist()), lambda: TomoP2D.ModelSino(model, N_size, P, angles, path_library2D))
 
 plt.figure(2)
 plt.rcParams.update({'font.size': 21})
@@ -109,7 +146,7 @@ plt.subplot(133)
 plt.imshow(FBPrec_misalign, vmin=0, vmax=3, cmap="gray")
 plt.colorbar(ticks=[0, 0.5, 2], orientation='vertical')
 plt.title('Misaligned noisy FBP Reconstruction')
-plt.show()
+show_figures()
 
 plt.figure() 
 plt.imshow(abs(FBPrec_ideal-FBPrec_error), vmin=0, vmax=2, cmap="gray")
@@ -119,6 +156,12 @@ plt.title('FBP reconsrtuction differences')
 print ("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%")
 print ("Reconstructing using FISTA method (tomobar)")
 print ("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%")
+try:
+    import cupy as xp # CuPy arrays keep the FISTA iterations on the GPU
+    asnumpy = xp.asnumpy
+except ImportError:
+    xp = np # CuPy is optional, NumPy arrays are used without it
+    asnumpy = np.asarray
 from tomobar.methodsIR import RecToolsIR
 RectoolsIR = RecToolsIR(DetectorsDimH = P,  # DetectorsDimH # detector dimension (horizontal)
                     DetectorsDimV = None,  # DetectorsDimV # detector dimension (vertical) for 3D case only
@@ -128,10 +171,14 @@ RectoolsIR = RecToolsIR(DetectorsDimH = P,  # DetectorsDimH # detector dimension
                     datafidelity='LS', #data fidelity, choose LS
                     device_projector='gpu')
 
+# with CuPy the sinogram is copied to the device once and FISTA iterations are kept on the GPU
+sino_gpu = xp.asarray(noisy_zing_stripe, dtype=xp.float32, order='C')
+
 # prepare dictionaries with parameters:
-_data_ = {'projection_norm_data' : noisy_zing_stripe} # data dictionary
+_data_ = {'projection_norm_data' : sino_gpu} # data dictionary
 lc = RectoolsIR.powermethod(_data_) # calculate Lipschitz constant (run once to initialise)
 _algorithm_ = {'iterations' : 350,
+               'initialise' : np.clip(FBPrec_error, 0, None), # warm start from FBP
                'lipschitz_const' : lc}
 
 # adding regularisation using the CCPi regularisation toolkit
@@ -141,18 +188,18 @@ _regularisation_ = {'method' : 'PD_TV',
                     'device_regulariser': 'gpu'}
 
 print("Run FISTA reconstrucion algorithm with regularisation...")
-RecFISTA_LS_reg = RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_)
+RecFISTA_LS_reg = asnumpy(RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_))
 
 # adding Huber data fidelity threshold 
 _data_.update({'huber_threshold' : 7.0})
 print(" Run FISTA reconstrucion algorithm with regularisation and Huber data...")
-RecFISTA_Huber_reg = RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_)
+RecFISTA_Huber_reg = asnumpy(RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_))
 
 print("Adding a better model for data with rings...")
 _data_.update({'ring_weights_threshold' : 7.0,
                'ring_tuple_halfsizes': (9,7,0)})
 
-RecFISTA_HuberRing_reg = RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_)
+RecFISTA_HuberRing_reg = asnumpy(RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_))
 
 plt.figure()
 plt.subplot(131)
@@ -167,15 +214,12 @@ plt.subplot(133)
 plt.imshow(RecFISTA_HuberRing_reg, vmin=0, vmax=1, cmap="gray")
 plt.colorbar(ticks=[0, 0.5, 1], orientation='vertical')
 plt.title('FISTA-HuberRing-TV reconstruction')
-plt.show()
+show_figures()
 
 # calculate errors 
-Qtools = QualityTools(phantom_2D, RecFISTA_LS_reg)
-RMSE_FISTA_LS_TV = Qtools.rmse()
-Qtools = QualityTools(phantom_2D, RecFISTA_Huber_reg)
-RMSE_FISTA_HUBER_TV = Qtools.rmse()
-Qtools = QualityTools(phantom_2D, RecFISTA_HuberRing_reg)
-RMSE_FISTA_HUBERRING_TV = Qtools.rmse()
+RMSE_FISTA_LS_TV = rmse(phantom_2D, RecFISTA_LS_reg)
+RMSE_FISTA_HUBER_TV = rmse(phantom_2D, RecFISTA_Huber_reg)
+RMSE_FISTA_HUBERRING_TV = rmse(phantom_2D, RecFISTA_HuberRing_reg)
 print("RMSE for FISTA-LS-TV reconstruction is {}".format(RMSE_FISTA_LS_TV))
 print("RMSE for FISTA-Huber-TV is {}".format(RMSE_FISTA_HUBER_TV))
 print("RMSE for FISTA-OS-HuberRing-TV is {}".format(RMSE_FISTA_HUBERRING_TV))
@@ -183,22 +227,14 @@ print("RMSE for FISTA-OS-HuberRing-TV is {}".format(RMSE_FISTA_HUBERRING_TV))
 print ("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%")
 print ("Reconstructing using FISTA-OS method (tomobar)")
 print ("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%")
-from tomobar.methodsIR import RecToolsIR
-RectoolsIR = RecToolsIR(DetectorsDimH = P,  # DetectorsDimH # detector dimension (horizontal)
-                    DetectorsDimV = None,  # DetectorsDimV # detector dimension (vertical) for 3D case only
-                    CenterRotOffset = None, # Center of Rotation (CoR) scalar (for 3D case only)
-                    AnglesVec = angles_rad, # array of angles in radians
-                    ObjSize = P, # a scalar to define reconstructed object dimensions
-                    datafidelity='LS', #data fidelity, choose LS
-                    device_projector='gpu')
-
+# the RectoolsIR object from above is reused (ASTRA projectors are shared)
 # prepare dictionaries with parameters:
-_data_ = {'projection_norm_data' : noisy_zing_stripe,
+_data_ = {'projection_norm_data' : sino_gpu,
           'OS_number' : 10} # data dictionary
-lc = RectoolsIR.powermethod(_data_) # calculate Lipschitz constant (run once to initialise)
+lc_OS = RectoolsIR.powermethod(_data_) # calculate Lipschitz constant for the OS version
 
 _algorithm_ = {'iterations' : 20,
-               'lipschitz_const' : lc}
+               'lipschitz_const' : lc_OS}
 
 # adding regularisation using the CCPi regularisation toolkit
 _regularisation_ = {'method' : 'PD_TV',
@@ -208,16 +244,16 @@ _regularisation_ = {'method' : 'PD_TV',
                     'device_regulariser': 'gpu'}
 
 print("Run FISTA-OS reconstrucion algorithm with regularisation...")
-RecFISTA_LS_reg = RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_)
+RecFISTA_LS_reg = asnumpy(RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_))
 
 print(" Run FISTA-OS reconstrucion algorithm with regularisation and Huber data...")
 _data_.update({'huber_threshold' : 7.0})
-RecFISTA_Huber_reg = RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_)
+RecFISTA_Huber_reg = asnumpy(RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_))
 
 print("adding a better model for data with rings...")
 _data_.update({'ring_weights_threshold' : 7.0,
                'ring_tuple_halfsizes': (9,7,0)}) #window sizes for (detectors,angles,slices)
-RecFISTA_HuberRing_reg = RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_)
+RecFISTA_HuberRing_reg = asnumpy(RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_))
 
 plt.figure()
 plt.subplot(131)
@@ -232,15 +268,12 @@ plt.subplot(133)
 plt.imshow(RecFISTA_HuberRing_reg, vmin=0, vmax=1, cmap="gray")
 plt.colorbar(ticks=[0, 0.5, 1], orientation='vertical')
 plt.title('FISTA-OS-HuberRing-TV reconstruction')
-plt.show()
+show_figures()
 
 # calculate errors 
-Qtools = QualityTools(phantom_2D, RecFISTA_LS_reg)
-RMSE_FISTA_LS_TV = Qtools.rmse()
-Qtools = QualityTools(phantom_2D, RecFISTA_Huber_reg)
-RMSE_FISTA_HUBER_TV = Qtools.rmse()
-Qtools = QualityTools(phantom_2D, RecFISTA_HuberRing_reg)
-RMSE_FISTA_HUBERRING_TV = Qtools.rmse()
+RMSE_FISTA_LS_TV = rmse(phantom_2D, RecFISTA_LS_reg)
+RMSE_FISTA_HUBER_TV = rmse(phantom_2D, RecFISTA_Huber_reg)
+RMSE_FISTA_HUBERRING_TV = rmse(phantom_2D, RecFISTA_HuberRing_reg)
 print("RMSE for FISTA-OS-LS-TV reconstruction is {}".format(RMSE_FISTA_LS_TV))
 print("RMSE for FISTA-OS-Huber-TV is {}".format(RMSE_FISTA_HUBER_TV))
 print("RMSE for FISTA-OS-HuberRing-TV is {}".format(RMSE_FISTA_HUBERRING_TV))
@@ -248,21 +281,13 @@ print("RMSE for FISTA-OS-HuberRing-TV is {}".format(RMSE_FISTA_HUBERRING_TV))
 print ("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%")
 print ("Reconstructing using FISTA-Group-Huber method (tomobar)")
 print ("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%")
-from tomobar.methodsIR import RecToolsIR
-RectoolsIR = RecToolsIR(DetectorsDimH = P,  # DetectorsDimH # detector dimension (horizontal)
-                    DetectorsDimV = None,  # DetectorsDimV # detector dimension (vertical) for 3D case only
-                    CenterRotOffset = None, # Center of Rotation (CoR) scalar (for 3D case only)
-                    AnglesVec = angles_rad, # array of angles in radians
-                    ObjSize = P, # a scalar to define reconstructed object dimensions
-                    datafidelity='LS', #data fidelity, choose LS
-                    device_projector='gpu')
-
+# the RectoolsIR object from above is reused (ASTRA projectors are shared)
 # prepare dictionaries with parameters:
-_data_ = {'projection_norm_data' : noisy_zing_stripe,
+_data_ = {'projection_norm_data' : sino_gpu,
          'ringGH_lambda' : 0.0025,
          'ringGH_accelerate': 100,
           } 
-lc = RectoolsIR.powermethod(_data_) # calculate Lipschitz constant (run once to initialise)
+# the same (non-OS) Lipschitz constant lc as calculated above
 _algorithm_ = {'iterations' : 350,
                'lipschitz_const' : lc}
 
@@ -273,16 +298,15 @@ _regularisation_ = {'method' : 'PD_TV',
                     'device_regulariser': 'gpu'}
 
 # Run FISTA reconstrucion algorithm with regularisation 
-RecFISTA_LS_GH_reg = RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_)
+RecFISTA_LS_GH_reg = asnumpy(RectoolsIR.FISTA(_data_, _algorithm_, _regularisation_))
 
 plt.figure()
 plt.imshow(RecFISTA_LS_GH_reg, vmin=0, vmax=1, cmap="gray")
 plt.colorbar(ticks=[0, 0.5, 1], orientation='vertical')
 plt.title('FISTA-OS-GH-TV reconstruction')
-plt.show()
+show_figures()
 
 # calculate errors 
-Qtools = QualityTools(phantom_2D, RecFISTA_LS_GH_reg)
-RMSE_FISTA_LS_GH_TV = Qtools.rmse()
+RMSE_FISTA_LS_GH_TV = rmse(phantom_2D, RecFISTA_LS_GH_reg)
 print("RMSE for FISTA-LS-GH-TV reconstruction is {}".format(RMSE_FISTA_LS_GH_TV))
 #%%
@@ -11,6 +11,8 @@ Dependencies:
     * CCPi-RGL toolkit (for regularisation), install with 
     conda install ccpi-regulariser -c ccpi -c conda-forge
     or conda build of  https://github.com/vais-ral/CCPi-Regularisation-Toolkit
+    * CuPy (optional, to keep FISTA iterations on the GPU), install with
+    conda install -c conda-forge cupy
 
 <<<
 IF THE SHARED DATA ARE USED FOR PUBLICATIONS/PRESENTATIONS etc., PLEASE CITE:
@@ -23,6 +25,12 @@ Measurement Science and Technology, 28(9), p.094004.
 import numpy as np
 import matplotlib.pyplot as plt
 import scipy.io
+try:
+    import cupy as xp # CuPy arrays keep the FISTA iterations on the GPU
+    asnumpy = xp.asnumpy
+except ImportError:
+    xp = np # CuPy is optional, NumPy arrays are used without it
+    asnumpy = np.asarray
 from tomobar.supp.suppTools import normaliser
 
 # load dendritic data
@@ -38,14 +46,14 @@ flats2[0,:,:] = flats[:]
 darks2 = np.zeros((1, np.size(darks,0), np.size(darks,1)), dtype='float32')
 darks2[0,:,:] = darks[:]
 
-dataRaw = np.swapaxes(dataRaw,0,1)
+dataRaw = np.ascontiguousarray(np.swapaxes(dataRaw,0,1), dtype=np.float32) # a single float32 copy
 
-# normalise the data, required format is [Projections, detectorsHoriz, Slices]
-data_norm = normaliser(dataRaw, flats2, darks2, log='log')
+# normalise the data on the GPU, required format is [Projections, detectorsHoriz, Slices]
+data_norm = normaliser(xp.asarray(dataRaw), xp.asarray(flats2), xp.asarray(darks2), log='log')
 
-dataRaw = np.float32(np.divide(dataRaw, np.max(dataRaw).astype(float)))
+dataRaw *= np.float32(1.0)/dataRaw.max() # scaled in place
 
-detectorHoriz = np.size(data_norm,1)
+detectorHoriz = data_norm.shape[1]
 N_size = 1000
 slice_to_recon = 19 # select which slice to reconstruct
 angles_rad = angles*(np.pi/180.0)
@@ -61,7 +69,11 @@ RectoolsDIR = RecToolsDIR(DetectorsDimH = detectorHoriz,  # DetectorsDimH # dete
                     ObjSize = N_size, # a scalar to define reconstructed object dimensions
                     device_projector='gpu')
 
-FBPrec = RectoolsDIR.FBP(data_norm[:,:,slice_to_recon])
+# FBP of all slices (a stack of 2D sinograms [slices, angles, detectorsHoriz]),
+# the ASTRA objects are created once and reused for every slice
+data_norm3D = np.ascontiguousarray(asnumpy(xp.transpose(data_norm, (2,0,1))))
+FBPrec3D = RectoolsDIR.FBP(data_norm3D)
+FBPrec = FBPrec3D[slice_to_recon,:,:] # the same 2D geometry as the FISTA warm start below
 
 plt.figure()
 plt.imshow(FBPrec[150:550,150:550], vmin=0, vmax=0.005, cmap="gray")
@@ -80,14 +92,16 @@ Rectools = RecToolsIR(DetectorsDimH = detectorHoriz,  # DetectorsDimH # detector
                     datafidelity='PWLS',# data fidelity, choose LS, PWLS
                     device_projector='gpu')
 
-# prepare dictionaries with parameters:
-_data_ = {'projection_norm_data' : data_norm[:,:,slice_to_recon],
-          'projection_raw_data' : dataRaw[:,:,slice_to_recon],
+# prepare dictionaries with parameters (with CuPy the data is copied to the device once):
+_data_ = {'projection_norm_data' : xp.asarray(data_norm[:,:,slice_to_recon], dtype=xp.float32, order='C'),
+          'projection_raw_data' : xp.asarray(dataRaw[:,:,slice_to_recon], dtype=xp.float32, order='C'),
           'OS_number' : 6} # data dictionary
 
 lc = Rectools.powermethod(_data_) # calculate Lipschitz constant (run once to initialise)
 _algorithm_ = {'iterations' : 20,
-               'lipschitz_const' : lc}
+               'initialise' : np.clip(FBPrec, 0, None), # warm start from FBP
+               'lipschitz_const' : lc,
+               'tolerance' : 1e-09} # stop earlier if the iterations stagnate
 
 # adding regularisation using the CCPi regularisation toolkit
 _regularisation_ = {'method' : 'PD_TV',
@@ -96,7 +110,7 @@ _regularisation_ = {'method' : 'PD_TV',
                     'methodTV' : 1,
                     'device_regulariser': 'gpu'}
 
-RecFISTA_os_tv_pwls = Rectools.FISTA(_data_, _algorithm_, _regularisation_)
+RecFISTA_os_tv_pwls = asnumpy(Rectools.FISTA(_data_, _algorithm_, _regularisation_))
 
 fig = plt.figure()
 plt.imshow(RecFISTA_os_tv_pwls[150:550,150:550], vmin=0, vmax=0.003, cmap="gray")
@@ -119,7 +133,7 @@ _regularisation_ = {'method' : 'PD_TV',
                     'device_regulariser': 'gpu'}
 
 # Run FISTA-PWLS-Group-Huber-OS reconstrucion algorithm with regularisation
-RecFISTA_pwls_GH_TV = Rectools.FISTA(_data_, _algorithm_, _regularisation_)
+RecFISTA_pwls_GH_TV = asnumpy(Rectools.FISTA(_data_, _algorithm_, _regularisation_))
 
 fig = plt.figure()
 plt.imshow(RecFISTA_pwls_GH_TV[150:550,150:550], vmin=0, vmax=0.003, cmap="gray")
@@ -137,7 +151,7 @@ _regularisation_ = {'method' : 'LLT_ROF',
                     'iterations' : 80,                    
                     'device_regulariser': 'gpu'}
 
-RecFISTA_pwls_os_rofllt = Rectools.FISTA(_data_, _algorithm_, _regularisation_)
+RecFISTA_pwls_os_rofllt = asnumpy(Rectools.FISTA(_data_, _algorithm_, _regularisation_))
 
 fig = plt.figure()
 plt.imshow(RecFISTA_pwls_os_rofllt[150:550,150:550], vmin=0, vmax=0.003, cmap="gray")
@@ -156,7 +170,7 @@ _regularisation_ = {'method' : 'TGV',
                     'iterations' : 100,                    
                     'device_regulariser': 'gpu'}
 
-RecFISTA_pwls_os_tgv = Rectools.FISTA(_data_, _algorithm_, _regularisation_)
+RecFISTA_pwls_os_tgv = asnumpy(Rectools.FISTA(_data_, _algorithm_, _regularisation_))
         
 
 fig = plt.figure()
@@ -178,7 +192,9 @@ _regularisation_ = {'method' : 'PD_TV',
                     'iterations' : 80,                    
                     'device_regulariser': 'gpu'}
 
-# Run ADMM-LS-TV reconstrucion algorithm
+# Run ADMM-LS-TV reconstrucion algorithm (host arrays)
+_data_.update({'projection_norm_data' : asnumpy(data_norm[:,:,slice_to_recon]),
+               'projection_raw_data' : dataRaw[:,:,slice_to_recon]})
 RecADMM_LS_TV = Rectools.ADMM(_data_, _algorithm_, _regularisation_)
 
 fig = plt.figure()
@@ -15,6 +15,8 @@ Dependencies:
     * CCPi-RGL toolkit (for regularisation), install with
     conda install ccpi-regulariser -c ccpi -c conda-forge
     or https://github.com/vais-ral/CCPi-Regularisation-Toolkit
+    * CuPy (optional, to keep FISTA iterations on the GPU), install with
+    conda install -c conda-forge cupy
 
 GPLv3 license (ASTRA toolbox)
 @author: Daniil Kazantsev: https://github.com/dkazanc
@@ -34,18 +36,101 @@ try:
 except:
     print('____! CCPi regularisation package is missing, please install !____')
 
+try:
+    import cupy as cp
+    from tomobar.supp.cupyOP import gradient_step_kernel, momentum_kernel, restart_product_kernel, ring_function_kernel, ring_weights_cupy, PD_TV_cupy
+    cupy_enabled = True
+except ImportError:
+    cupy_enabled = False
+
 # function to smooth 1D signal
 def smooth(y, box_pts):
     box = np.ones(box_pts)/box_pts
     y_smooth = np.convolve(y, box, mode='same')
     return y_smooth
 
+def ring_weights(residual, _data_):
+    # weights of the better ring model: RING_WEIGHTS followed by the Huber-type thresholding
+    (halfsize_detectors, halfsize_angles, halfsize_projections) = _data_['ring_tuple_halfsizes']
+    threshold = _data_['ring_weights_threshold']
+    if (cupy_enabled and isinstance(residual, cp.ndarray)):
+        rings_weights = ring_weights_cupy(residual, halfsize_detectors, halfsize_angles, halfsize_projections)
+        return ring_function_kernel(rings_weights, rings_weights.dtype.type(threshold), rings_weights.dtype.type(_data_['ring_huber_power']))
+    rings_weights = np.abs(RING_WEIGHTS(residual, halfsize_detectors, halfsize_angles, halfsize_projections))
+    return np.where(rings_weights > threshold, threshold/np.maximum(rings_weights, threshold)**_data_['ring_huber_power'], np.float32(1.0))
+
+def gradient_step(X_t, grad_fidelity, L_const_inv, nonnegativity):
+    # X = X_t - L_const_inv*grad_fidelity (and nonnegativity) in a single pass over the data
+    if (cupy_enabled and isinstance(X_t, cp.ndarray)):
+        return gradient_step_kernel(X_t, grad_fidelity, X_t.dtype.type(L_const_inv), nonnegativity == 'ENABLE')
+    X = np.multiply(grad_fidelity, -L_const_inv, out=grad_fidelity) # gradient is not reused
+    X += X_t
+    if (nonnegativity == 'ENABLE'):
+        np.maximum(X, 0.0, out=X)
+    return X
+
+def momentum_step(X, X_old, beta):
+    # X_t = X + beta*(X - X_old) without intermediate arrays
+    if (cupy_enabled and isinstance(X, cp.ndarray)):
+        return momentum_kernel(X, X_old, cp.asarray(beta, dtype=X.dtype))
+    X_t = np.subtract(X, X_old)
+    X_t *= beta
+    X_t += X
+    return X_t
+
+def restart_product(X_t, X, X_old, buffers):
+    # <X_t - X, X - X_old> of the gradient restart test, NumPy differences go to the preallocated buffers
+    if (cupy_enabled and isinstance(X, cp.ndarray)):
+        return restart_product_kernel(X_t, X, X_old)
+    np.subtract(X_t, X, out=buffers[0])
+    np.subtract(X, X_old, out=buffers[1])
+    return np.vdot(buffers[0], buffers[1])
+
 def merge_3_dicts(x, y, z):
     merg = x.copy()
     merg.update(y)
     merg.update(z)
     return merg
 
+def astra_tools_init(self, _data_):
+    # initialise ASTRA-related modules for the provided data
+    # CuPy arrays are kept on the device and projected using ASTRA 3D projectors
+    # directly (2D data is treated as a single slice 3D volume)
+    # ASTRA objects are created once and reused by all subsequent calls (same geometry)
+    self.cupyrun = (cupy_enabled and isinstance(_data_['projection_norm_data'], cp.ndarray))
+    # all calculations are performed in single precision
+    if (self.cupyrun):
+        xp = cp
+    else:
+        xp = np
+    for data_key in ['projection_norm_data', 'projection_raw_data']:
+        if (data_key in _data_):
+            _data_[data_key] = xp.asarray(_data_[data_key], dtype=xp.float32)
+    if (self.cupyrun and (self.geom == '2D')):
+        if (self.AtoolsCuPy is None):
+            from tomobar.supp.astraOP import AstraTools3D
+            self.AtoolsCuPy = AstraTools3D(self.DetectorsDimH, 1, self.AnglesVec, self.CenterRotOffset, self.ObjSize) # initiate 3D ASTRA class object
+    elif (self.geom == '3D'):
+        self.AtoolsCuPy = self.Atools
+    if (('OS_number' not in _data_) or (_data_['OS_number'] is None)):
+        # Ordered Subsets OR classical approach (default)
+        _data_['OS_number'] = 1
+    else:
+        #initialise OS ASTRA-related modules
+        OS_key = (_data_['OS_number'], self.cupyrun)
+        if (OS_key not in self.AtoolsOS_list):
+            if ((self.geom == '2D') and not self.cupyrun):
+                from tomobar.supp.astraOP import AstraToolsOS
+                self.AtoolsOS_list[OS_key] = AstraToolsOS(self.DetectorsDimH, self.AnglesVec, self.ObjSize, _data_['OS_number'], self.device_projector) # initiate 2D ASTRA class OS object
+            else:
+                from tomobar.supp.astraOP import AstraToolsOS3D
+                if (self.geom == '2D'):
+                    DetectorsDimV = 1
+                else:
+                    DetectorsDimV = self.DetectorsDimV
+                self.AtoolsOS_list[OS_key] = AstraToolsOS3D(self.DetectorsDimH, DetectorsDimV, self.AnglesVec, self.CenterRotOffset, self.ObjSize, _data_['OS_number']) # initiate 3D ASTRA class OS object
+        self.AtoolsOS = self.AtoolsOS_list[OS_key]
+
 def dict_check(self, _data_, _algorithm_, _regularisation_):
     # checking and initialisaing all required parameters
     # ---------- deal with _data_ dictionary first --------------
@@ -55,17 +140,7 @@ def dict_check(self, _data_, _algorithm_, _regularisation_):
     # projection nomnalised raw data as PWLS-model weights
     if (('projection_raw_data' not in _data_) and (self.datafidelity == 'PWLS')):
           raise NameError("No input 'projection_raw_data' have been provided")
-    if (('OS_number' not in _data_) or (_data_['OS_number'] is None)):
-        # Ordered Subsets OR classical approach (default)
-        _data_['OS_number'] = 1
-    else:
-        #initialise OS ASTRA-related modules
-        if self.geom == '2D':
-            from tomobar.supp.astraOP import AstraToolsOS
-            self.AtoolsOS = AstraToolsOS(self.DetectorsDimH, self.AnglesVec, self.ObjSize, _data_['OS_number'], self.device_projector) # initiate 2D ASTRA class OS object
-        else:
-            from tomobar.supp.astraOP import AstraToolsOS3D
-            self.AtoolsOS = AstraToolsOS3D(self.DetectorsDimH, self.DetectorsDimV, self.AnglesVec, self.CenterRotOffset, self.ObjSize, _data_['OS_number']) # initiate 3D ASTRA class OS object
+    astra_tools_init(self, _data_)
     # Huber data model to supress artifacts
     if ('huber_threshold' not in _data_):
         _data_['huber_threshold'] = None
@@ -111,9 +186,14 @@ def dict_check(self, _data_, _algorithm_, _regularisation_):
         _algorithm_['nonnegativity'] = 'ENABLE'
     if (_algorithm_['nonnegativity'] == 'ENABLE'):
         self.nonneg_regul = 1 # enable nonnegativity for regularisers
+    else:
+        self.nonneg_regul = 0
     # tolerance to stop OUTER algorithm iterations earlier
     if ('tolerance' not in _algorithm_):
         _algorithm_['tolerance'] = 0.0
+    # FISTA adaptive restart of the momentum: 'gradient' (default) or None
+    if ('restart' not in _algorithm_):
+        _algorithm_['restart'] = 'gradient'
     if ('verbose' not in _algorithm_):
         _algorithm_['verbose'] = 'on'
     # ----------  deal with _regularisation_  --------------
@@ -183,37 +263,68 @@ def dict_check(self, _data_, _algorithm_, _regularisation_):
         print('Parameters check has been succesfull, running the algorithm...')
 
 
-def prox_regul(self, X, _regularisation_):
-    info_vec = (_regularisation_['iterations'],0)
-    # The proximal operator of the chosen regulariser
-    if (_regularisation_['method'] == 'ROF_TV'):
+def regul_function(self, _regularisation_):
+    # builds the proximal operator of the chosen regulariser once, the
+    # parameters are read here so that the iterations only pass the image
+    method = _regularisation_['method']
+    regul_param = _regularisation_['regul_param']
+    regul_param2 = _regularisation_['regul_param2']
+    iterations = _regularisation_['iterations']
+    tolerance = _regularisation_['tolerance']
+    time_marching_step = _regularisation_['time_marching_step']
+    TGV_alpha1 = _regularisation_['TGV_alpha1']
+    TGV_alpha2 = _regularisation_['TGV_alpha2']
+    PD_LipschitzConstant = _regularisation_['PD_LipschitzConstant']
+    edge_threhsold = _regularisation_['edge_threhsold']
+    methodTV = _regularisation_['methodTV']
+    device = _regularisation_['device_regulariser']
+    if (method == 'ROF_TV'):
         # Rudin - Osher - Fatemi Total variation method
-        (X,info_vec) = ROF_TV(X, _regularisation_['regul_param'], _regularisation_['iterations'], _regularisation_['time_marching_step'], _regularisation_['tolerance'], _regularisation_['device_regulariser'])
-    if (_regularisation_['method'] == 'FGP_TV'):
+        regul = lambda X: ROF_TV(X, regul_param, iterations, time_marching_step, tolerance, device)
+    elif (method == 'FGP_TV'):
         # Fast-Gradient-Projection Total variation method
-        (X,info_vec) = FGP_TV(X, _regularisation_['regul_param'], _regularisation_['iterations'], _regularisation_['tolerance'], _regularisation_['methodTV'], self.nonneg_regul, _regularisation_['device_regulariser'])
-    if (_regularisation_['method'] == 'PD_TV'):
+        nonneg_regul = self.nonneg_regul
+        regul = lambda X: FGP_TV(X, regul_param, iterations, tolerance, methodTV, nonneg_regul, device)
+    elif (method == 'PD_TV'):
         # Primal-Dual (PD) Total variation method by Chambolle-Pock
-        (X,info_vec) = PD_TV(X, _regularisation_['regul_param'], _regularisation_['iterations'], _regularisation_['tolerance'], _regularisation_['methodTV'], self.nonneg_regul, _regularisation_['PD_LipschitzConstant'], _regularisation_['device_regulariser'])
-    if (_regularisation_['method'] == 'SB_TV'):
+        nonneg_regul = self.nonneg_regul
+        regul = lambda X: PD_TV(X, regul_param, iterations, tolerance, methodTV, nonneg_regul, PD_LipschitzConstant, device)
+    elif (method == 'SB_TV'):
         # Split Bregman Total variation method
-        (X,info_vec) = SB_TV(X, _regularisation_['regul_param'], _regularisation_['iterations'], _regularisation_['tolerance'], _regularisation_['methodTV'], _regularisation_['device_regulariser'])
-    if (_regularisation_['method'] == 'LLT_ROF'):
+        regul = lambda X: SB_TV(X, regul_param, iterations, tolerance, methodTV, device)
+    elif (method == 'LLT_ROF'):
         # Lysaker-Lundervold-Tai + ROF Total variation method
-        (X,info_vec) = LLT_ROF(X, _regularisation_['regul_param'], _regularisation_['regul_param2'], _regularisation_['iterations'], _regularisation_['time_marching_step'], _regularisation_['tolerance'], _regularisation_['device_regulariser'])
-    if (_regularisation_['method'] == 'TGV'):
+        regul = lambda X: LLT_ROF(X, regul_param, regul_param2, iterations, time_marching_step, tolerance, device)
+    elif (method == 'TGV'):
         # Total Generalised Variation method
-        (X,info_vec) = TGV(X, _regularisation_['regul_param'], _regularisation_['TGV_alpha1'], _regularisation_['TGV_alpha2'], _regularisation_['iterations'], _regularisation_['PD_LipschitzConstant'], _regularisation_['tolerance'], _regularisation_['device_regulariser'])
-    if (_regularisation_['method'] == 'NDF'):
+        regul = lambda X: TGV(X, regul_param, TGV_alpha1, TGV_alpha2, iterations, PD_LipschitzConstant, tolerance, device)
+    elif (method == 'NDF'):
         # Nonlinear isotropic diffusion method
-        (X,info_vec) = NDF(X, _regularisation_['regul_param'], _regularisation_['edge_threhsold'], _regularisation_['iterations'], _regularisation_['time_marching_step'], self.NDF_method, _regularisation_['tolerance'], _regularisation_['device_regulariser'])
-    if (_regularisation_['method'] == 'Diff4th'):
+        NDF_method = self.NDF_method
+        regul = lambda X: NDF(X, regul_param, edge_threhsold, iterations, time_marching_step, NDF_method, tolerance, device)
+    elif (method == 'Diff4th'):
         # Anisotropic diffusion of higher order
-        (X,info_vec) = Diff4th(X, _regularisation_['regul_param'], _regularisation_['edge_threhsold'], _regularisation_['iterations'], _regularisation_['time_marching_step'], _regularisation_['tolerance'], _regularisation_['device_regulariser'])
-    if (_regularisation_['method'] == 'NLTV'):
+        regul = lambda X: Diff4th(X, regul_param, edge_threhsold, iterations, time_marching_step, tolerance, device)
+    elif (method == 'NLTV'):
         # Non-local Total Variation
-        X = NLTV(X, _regularisation_['NLTV_H_i'], _regularisation_['NLTV_H_j'], _regularisation_['NLTV_H_j'],_regularisation_['NLTV_Weights'], _regularisation_['regul_param'], _regularisation_['iterations'])
-    return (X,info_vec)
+        NLTV_H_i = _regularisation_['NLTV_H_i']
+        NLTV_H_j = _regularisation_['NLTV_H_j']
+        NLTV_Weights = _regularisation_['NLTV_Weights']
+        info_NLTV = (iterations,0)
+        regul = lambda X: (NLTV(X, NLTV_H_i, NLTV_H_j, NLTV_H_j, NLTV_Weights, regul_param, iterations), info_NLTV)
+    else:
+        info_none = (iterations,0)
+        regul = lambda X: (X, info_none)
+    if (self.cupyrun and (method == 'PD_TV') and (device == 'gpu')):
+        # CuPy data: PD_TV is run on the device (kernels compiled for the image shape and parameters)
+        regul = lambda X: PD_TV_cupy(X, regul_param, iterations, tolerance, methodTV, nonneg_regul, PD_LipschitzConstant)
+    elif (self.cupyrun):
+        # CCPi-RGL regularisers operate on host arrays
+        regul_host = regul
+        def regul(X):
+            (X,info_vec) = regul_host(cp.asnumpy(X))
+            return (cp.asarray(X),info_vec)
+    return regul
 
 class RecToolsIR:
     """
@@ -231,8 +342,8 @@ class RecToolsIR:
 
     Parameters for reconstruction algorithms extracted from 3 dictionaries:
       _data_ :
-            --projection_norm_data # the flat/dark field normalised -log projection data: sinogram or 3D data
-            --projection_raw_data # for PWLS model you also need to provide the raw data
+            --projection_norm_data # the flat/dark field normalised -log projection data: sinogram or 3D data (NumPy or CuPy array, CuPy keeps FISTA on the device)
+            --projection_raw_data # for PWLS model you also need to provide the raw data (the same array type as above)
             --OS_number # the number of subsets, NONE/(or > 1) ~ classical / ordered subsets
             --huber_threshold # threshold for Huber function to apply to data model (supress outliers)
             --studentst_threshold # threshold for Students't function to apply to data model (supress outliers)
@@ -243,12 +354,13 @@ class RecToolsIR:
             --ringGH_accelerate # Group-Huber data model acceleration factor (use carefully to avoid divergence, 50 default)
      _algorithm_ :
             --iterations # the number of reconstruction algorithm iterations
-            --initialise # initialise an algorithm with an array
+            --initialise # initialise an algorithm with an array (warm start, e.g. with a nonnegative FBP reconstruction)
             --nonnegativity # ENABLE (default) or DISABLE the nonnegativity for algorithms
-            --lipschitz_const # Lipschitz constant for FISTA algorithm, if not given will be calculated for each call
+            --lipschitz_const # Lipschitz constant for FISTA algorithm, if not given will be calculated (once per geometry for LS)
             --ADMM_rho_const # only for ADMM algorithm augmented Lagrangian parameter
             --ADMM_relax_par # ADMM-specific over relaxation parameter for convergence speed
             --tolerance # tolerance to terminate reconstruction algorithm iterations earlier, default 0.0
+            --restart # FISTA momentum restart, 'gradient' (default) resets the momentum if the step goes uphill, None to disable
             --verbose # mode to print iterations number and other messages ('on' by default, 'off' to suppress)
      _regularisation_ :
             --method # select a regularisation method: ROF_TV,FGP_TV,SB_TV,LLT_ROF,TGV,NDF,Diff4th,NLTV
@@ -313,6 +425,9 @@ class RecToolsIR:
             # classical approach
             from tomobar.supp.astraOP import AstraTools3D
             self.Atools = AstraTools3D(self.DetectorsDimH, self.DetectorsDimV, self.AnglesVec, self.CenterRotOffset, self.ObjSize) # initiate 3D ASTRA class object
+        self.AtoolsCuPy = None # ASTRA class object for the CuPy data (created when needed)
+        self.AtoolsOS_list = {} # ASTRA class OS objects for the different number of subsets
+        self.lipschitz_const_list = {} # calculated Lipschitz constants (LS fidelity)
         return None
             
 
@@ -343,57 +458,67 @@ class RecToolsIR:
     def powermethod(self, _data_):
         # power iteration algorithm to  calculate the eigenvalue of the operator (projection matrix)
         # projection_raw_data is required for PWLS fidelity (self.datafidelity = PWLS), otherwise will be ignored
-        if (('OS_number' not in _data_) or (_data_['OS_number'] is None)):
-            # Ordered Subsets OR classical approach (default)
-            _data_['OS_number'] = 1
-        else:
-            #initialise OS ASTRA-related modules
-            if self.geom == '2D':
-                from tomobar.supp.astraOP import AstraToolsOS
-                self.AtoolsOS = AstraToolsOS(self.DetectorsDimH, self.AnglesVec, self.ObjSize, _data_['OS_number'], self.device_projector) # initiate 2D ASTRA class OS object
-            else:
-                from tomobar.supp.astraOP import AstraToolsOS3D
-                self.AtoolsOS = AstraToolsOS3D(self.DetectorsDimH, self.DetectorsDimV, self.AnglesVec, self.CenterRotOffset, self.ObjSize, _data_['OS_number']) # initiate 3D ASTRA class OS object
-        niter = 15 # number of power method iterations
+        astra_tools_init(self, _data_)
+        # for LS fidelity the constant depends on the geometry only, hence it is calculated once
+        lc_key = (_data_['OS_number'], self.cupyrun)
+        if ((self.datafidelity == 'LS') and (lc_key in self.lipschitz_const_list)):
+            return self.lipschitz_const_list[lc_key]
+        niter = 20 # the maximum number of power method iterations
+        tol = 1e-3 # relative change of the eigenvalue to stop iterations
         s = 1.0
+        if (self.cupyrun):
+            xp = cp
+            Atools = self.AtoolsCuPy
+        else:
+            xp = np
+            Atools = self.Atools
         
         # classical approach 
         if (self.geom == '2D'):
-            x1 = np.float32(np.random.randn(self.Atools.ObjSize,self.Atools.ObjSize))
+            x1 = xp.random.randn(self.ObjSize,self.ObjSize).astype(xp.float32)
         else:
-            x1 = np.float32(np.random.randn(self.Atools.DetectorsDimV,self.Atools.ObjSize,self.Atools.ObjSize))
+            x1 = xp.random.randn(self.DetectorsDimV,self.ObjSize,self.ObjSize).astype(xp.float32)
         if (self.datafidelity == 'PWLS'):
-                sqweight = np.sqrt(_data_['projection_raw_data'])
+                sqweight = xp.sqrt(_data_['projection_raw_data'])
         if (_data_['OS_number'] == 1):
             # non-OS approach
-            y = self.Atools.forwproj(x1)
+            y = Atools.forwproj(x1)
             if (self.datafidelity == 'PWLS'):
-                y = np.multiply(sqweight, y)
+                y = xp.multiply(sqweight, y)
             for iter in range(0,niter):
-                x1 = self.Atools.backproj(y)
-                s = LA.norm(x1)
+                x1 = Atools.backproj(y)
+                s_old = s
+                s = float(xp.linalg.norm(x1))
                 x1 = x1/s
-                y = self.Atools.forwproj(x1)
+                if (abs(s - s_old) < tol*s):
+                    break
+                y = Atools.forwproj(x1)
                 if (self.datafidelity == 'PWLS'):
-                    y = np.multiply(sqweight, y)
+                    y = xp.multiply(sqweight, y)
         else:
             # OS approach
+            indVec = xp.asarray(self.AtoolsOS.indVec_list[0])
             y = self.AtoolsOS.forwprojOS(x1,0)
             if (self.datafidelity == 'PWLS'):
                 if (self.geom == '2D'):
-                    y = np.multiply(sqweight[self.AtoolsOS.newInd_Vec[0,:],:], y)
+                    y = xp.multiply(sqweight[indVec,:], y)
                 else:
-                    y = np.multiply(sqweight[:,self.AtoolsOS.newInd_Vec[0,:],:], y)
+                    y = xp.multiply(sqweight[:,indVec,:], y)
             for iter in range(0,niter):
                 x1 = self.AtoolsOS.backprojOS(y,0)
-                s = LA.norm(x1)
+                s_old = s
+                s = float(xp.linalg.norm(x1))
                 x1 = x1/s
+                if (abs(s - s_old) < tol*s):
+                    break
                 y = self.AtoolsOS.forwprojOS(x1,0)
                 if (self.datafidelity == 'PWLS'):
                     if (self.geom == '2D'):
-                        y = np.multiply(sqweight[self.AtoolsOS.newInd_Vec[0,:],:], y)
+                        y = xp.multiply(sqweight[indVec,:], y)
                     else:
-                        y = np.multiply(sqweight[:,self.AtoolsOS.newInd_Vec[0,:],:], y)
+                        y = xp.multiply(sqweight[:,indVec,:], y)
+        if (self.datafidelity == 'LS'):
+            self.lipschitz_const_list[lc_key] = s
         return s
 
     def FISTA(self, _data_, _algorithm_, _regularisation_):
@@ -402,47 +527,60 @@ class RecToolsIR:
         dict_check(self, _data_, _algorithm_, _regularisation_)
         ######################################################################
 
-        L_const_inv = 1.0/_algorithm_['lipschitz_const'] # inverted Lipschitz constant
+        if (self.cupyrun):
+            # CuPy data: iterates, residuals and gradients are kept on the device
+            xp = cp
+            Atools = self.AtoolsCuPy
+        else:
+            xp = np
+            Atools = self.Atools
+        L_const_inv = np.float32(1.0/_algorithm_['lipschitz_const']) # inverted Lipschitz constant
         if (self.geom == '2D'):
             # 2D reconstruction
             # initialise the solution
             if (np.size(_algorithm_['initialise']) == self.ObjSize**2):
-                # the object has been initialised with an array
-                X = _algorithm_['initialise']
-                del initialise
+                # the object has been initialised with an array (e.g. FBP reconstruction)
+                X = xp.array(_algorithm_['initialise'], dtype='float32').reshape((self.ObjSize,self.ObjSize))
             else:
-                X = np.zeros((self.ObjSize,self.ObjSize), 'float32') # initialise with zeros
-            r = np.zeros((self.DetectorsDimH,1),'float32') # 1D array of sparse "ring" variables (GH)
+                X = xp.zeros((self.ObjSize,self.ObjSize), 'float32') # initialise with zeros
+            r = xp.zeros((self.DetectorsDimH,1),'float32') # 1D array of sparse "ring" variables (GH)
         if (self.geom == '3D'):
             # initialise the solution
-            if (np.size(_algorithm_['initialise']) == self.ObjSize**3):
-                # the object has been initialised with an array
-                X = _algorithm_['initialise']
-                del initialise
+            if (np.size(_algorithm_['initialise']) == self.DetectorsDimV*self.ObjSize**2):
+                # the object has been initialised with an array (e.g. FBP reconstruction)
+                X = xp.array(_algorithm_['initialise'], dtype='float32').reshape((self.DetectorsDimV,self.ObjSize,self.ObjSize))
             else:
-                X = np.zeros((self.DetectorsDimV,self.ObjSize,self.ObjSize), 'float32') # initialise with zeros
-            r = np.zeros((self.DetectorsDimV,self.DetectorsDimH), 'float32') # 2D array of sparse "ring" variables (GH)
+                X = xp.zeros((self.DetectorsDimV,self.ObjSize,self.ObjSize), 'float32') # initialise with zeros
+            r = xp.zeros((self.DetectorsDimV,self.DetectorsDimH), 'float32') # 2D array of sparse "ring" variables (GH)
         info_vec = (0,1)
+        regul = regul_function(self, _regularisation_) # the proximal operator with all parameters bound
+        if (_data_['OS_number'] > 1):
+            # subset indices are moved to the device once, subsets are visited in the bit-reversed order
+            indVec_list = [xp.asarray(indVec) for indVec in self.AtoolsOS.indVec_list]
+            subset_order = self.AtoolsOS.subset_order
+        else:
+            subset_order = range(1)
         #****************************************************************************#
         # FISTA (model-based modification) algorithm begins here:
-        t = 1.0
+        t = np.float32(1.0)
         denomN = 1.0/np.size(X)
-        X_t = np.copy(X)
+        X_t = X.copy()
         r_x = r.copy()
+        if ((_algorithm_['restart'] == 'gradient') and (xp is np)):
+            restart_buffers = (np.empty_like(X), np.empty_like(X)) # reused by the restart test
+        else:
+            restart_buffers = None
         # Outer FISTA iterations
         for iter in range(0,_algorithm_['iterations']):
             r_old = r
             # Do GH fidelity pre-calculations using the full projections dataset for OS version
             if ((_data_['OS_number'] != 1) and (_data_['ringGH_lambda'] is not None) and (iter > 0)):
                 if (self.geom == '2D'):
-                    vec = np.zeros((self.DetectorsDimH))
+                    vec = xp.zeros((self.DetectorsDimH), 'float32')
                 else:
-                    vec = np.zeros((self.DetectorsDimV, self.DetectorsDimH))
+                    vec = xp.zeros((self.DetectorsDimV, self.DetectorsDimH), 'float32')
                 for sub_ind in range(_data_['OS_number']):
-                    #select a specific set of indeces for the subset (OS)
-                    indVec = self.AtoolsOS.newInd_Vec[sub_ind,:]
-                    if (indVec[self.AtoolsOS.NumbProjBins-1] == 0):
-                        indVec = indVec[:-1] #shrink vector size
+                    indVec = indVec_list[sub_ind] # a specific set of indeces for the subset (OS)
                     if (self.geom == '2D'):
                          res = self.AtoolsOS.forwprojOS(X_t,sub_ind) - _data_['projection_norm_data'][indVec,:]
                          res[:,0:None] = res[:,0:None] + _data_['ringGH_accelerate']*r_x[:,0]
@@ -453,25 +591,20 @@ class RecToolsIR:
                             res[:,ang_index,:] = res[:,ang_index,:] + _data_['ringGH_accelerate']*r_x
                         vec = res.sum(axis = 1)
                 if (self.geom == '2D'):
-                    r[:,0] = r_x[:,0] - np.multiply(L_const_inv,vec)
+                    r[:,0] = r_x[:,0] - xp.multiply(L_const_inv,vec)
                 else:
-                    r = r_x - np.multiply(L_const_inv,vec)
+                    r = r_x - xp.multiply(L_const_inv,vec)
             
             if ((_data_['OS_number'] != 1) and (_data_['ring_weights_threshold'] is not None) and (iter > 0)):
                 # Ordered subset approach for a better ring model 
-                res_full = self.Atools.forwproj(X_t) - _data_['projection_norm_data']
-                rings_weights = RING_WEIGHTS(res_full, _data_['ring_tuple_halfsizes'][0], _data_['ring_tuple_halfsizes'][1], _data_['ring_tuple_halfsizes'][2])
-                ring_function_weight = np.ones(np.shape(res_full))
-                ring_function_weight[(np.where(np.abs(rings_weights) > _data_['ring_weights_threshold']))] = np.divide(_data_['ring_weights_threshold'], np.abs(rings_weights[(np.where(np.abs(rings_weights) > _data_['ring_weights_threshold']))])**_data_['ring_huber_power'])
+                res_full = Atools.forwproj(X_t) - _data_['projection_norm_data']
+                ring_function_weight = ring_weights(res_full, _data_)
             # loop over subsets (OS)
-            for sub_ind in range(_data_['OS_number']):
+            for sub_ind in subset_order:
                 X_old = X
                 t_old = t
                 if (_data_['OS_number'] > 1):
-                    #select a specific set of indeces for the subset (OS)
-                    indVec = self.AtoolsOS.newInd_Vec[sub_ind,:]
-                    if (indVec[self.AtoolsOS.NumbProjBins-1] == 0):
-                        indVec = indVec[:-1] #shrink vector size
+                    indVec = indVec_list[sub_ind] # a specific set of indeces for the subset (OS)
                     if (_data_['OS_number'] != 1):
                         # OS-reduced residuals
                         if (self.geom == '2D'):
@@ -480,7 +613,7 @@ class RecToolsIR:
                                 res = self.AtoolsOS.forwprojOS(X_t,sub_ind) - _data_['projection_norm_data'][indVec,:]
                             if (self.datafidelity == 'PWLS'):
                                 # 2D Penalised Weighted Least-squares - OS data fidelity (approximately linear)
-                                res = np.multiply(_data_['projection_raw_data'][indVec,:], (self.AtoolsOS.forwprojOS(X_t,sub_ind) - _data_['projection_norm_data'][indVec,:]))
+                                res = xp.multiply(_data_['projection_raw_data'][indVec,:], (self.AtoolsOS.forwprojOS(X_t,sub_ind) - _data_['projection_norm_data'][indVec,:]))
                             # ring removal part for Group-Huber (GH) fidelity (2D)
                             if ((_data_['ringGH_lambda'] is not None) and (iter > 0)):
                                 res[:,0:None] = res[:,0:None] + _data_['ringGH_accelerate']*r_x[:,0]
@@ -490,77 +623,78 @@ class RecToolsIR:
                                 res = self.AtoolsOS.forwprojOS(X_t,sub_ind) - _data_['projection_norm_data'][:,indVec,:]
                             if (self.datafidelity == 'PWLS'):
                                 # 3D Penalised Weighted Least-squares - OS data fidelity (approximately linear)
-                                res = np.multiply(_data_['projection_raw_data'][:,indVec,:], (self.AtoolsOS.forwprojOS(X_t,sub_ind) - _data_['projection_norm_data'][:,indVec,:]))
+                                res = xp.multiply(_data_['projection_raw_data'][:,indVec,:], (self.AtoolsOS.forwprojOS(X_t,sub_ind) - _data_['projection_norm_data'][:,indVec,:]))
                             # GH - fidelity part (3D)
                             if ((_data_['ringGH_lambda'] is not None) and (iter > 0)):
                                 for ang_index in range(len(indVec)):
                                     res[:,ang_index,:] = res[:,ang_index,:] + _data_['ringGH_accelerate']*r_x
                         if ((_data_['ring_weights_threshold'] is not None) and (iter > 0)):
                             if (self.geom == '2D'):
-                                res = np.multiply(ring_function_weight[indVec,:],res)
+                                res = xp.multiply(ring_function_weight[indVec,:],res)
                             else:
-                                res = np.multiply(ring_function_weight[:,indVec,:],res)
+                                res = xp.multiply(ring_function_weight[:,indVec,:],res)
                 else: # non-OS (classical all-data approach)
                         if (self.datafidelity == 'LS'):
                             # full residual for LS fidelity
-                            res = self.Atools.forwproj(X_t) - _data_['projection_norm_data']
+                            res = Atools.forwproj(X_t) - _data_['projection_norm_data']
                         if (self.datafidelity == 'PWLS'):
                             # full gradient for the PWLS fidelity
-                            res = np.multiply(_data_['projection_raw_data'], (self.Atools.forwproj(X_t) - _data_['projection_norm_data']))
+                            res = xp.multiply(_data_['projection_raw_data'], (Atools.forwproj(X_t) - _data_['projection_norm_data']))
                         if ((self.geom == '2D') and (_data_['ringGH_lambda'] is not None) and (iter > 0)):  # GH 2D part
                             res[0:None,:] = res[0:None,:] + _data_['ringGH_accelerate']*r_x[:,0]
                             vec = res.sum(axis = 0)
-                            r[:,0] = r_x[:,0] - np.multiply(L_const_inv,vec)
+                            r[:,0] = r_x[:,0] - xp.multiply(L_const_inv,vec)
                         if ((self.geom == '3D') and (_data_['ringGH_lambda'] is not None) and (iter > 0)):  # GH 3D part
                             for ang_index in range(self.angles_number):
                                 res[:,ang_index,:] = res[:,ang_index,:] + _data_['ringGH_accelerate']*r_x
                                 vec = res.sum(axis = 1)
-                                r = r_x - np.multiply(L_const_inv,vec)
+                                r = r_x - xp.multiply(L_const_inv,vec)
                         if ((_data_['ring_weights_threshold'] is not None) and (iter > 0)):
                             # Approach for a better ring model
-                            rings_weights = RING_WEIGHTS(res, _data_['ring_tuple_halfsizes'][0], _data_['ring_tuple_halfsizes'][1], _data_['ring_tuple_halfsizes'][2])
-                            ring_function_weight = np.ones(np.shape(res))
-                            ring_function_weight[(np.where(np.abs(rings_weights) > _data_['ring_weights_threshold']))] = np.divide(_data_['ring_weights_threshold'], np.abs(rings_weights[(np.where(np.abs(rings_weights) > _data_['ring_weights_threshold']))])**_data_['ring_huber_power'])
-                            res = np.multiply(ring_function_weight,res)
+                            ring_function_weight = ring_weights(res, _data_)
+                            res = xp.multiply(ring_function_weight,res)
                 if (_data_['huber_threshold'] is not None):
-                    # apply Huber penalty
-                    multHuber = np.ones(np.shape(res))
-                    multHuber[(np.where(np.abs(res) > _data_['huber_threshold']))] = np.divide(_data_['huber_threshold'], np.abs(res[(np.where(np.abs(res) > _data_['huber_threshold']))]))
+                    # apply Huber penalty: the residual weighted by min(1, threshold/|res|) equals the clipped residual
+                    res = xp.clip(res, -_data_['huber_threshold'], _data_['huber_threshold'], out=res)
                     if (_data_['OS_number'] != 1):
                         # OS-Huber-gradient
-                        grad_fidelity = self.AtoolsOS.backprojOS(np.multiply(multHuber,res), sub_ind)
+                        grad_fidelity = self.AtoolsOS.backprojOS(res, sub_ind)
                     else:
                         # full Huber gradient
-                        grad_fidelity = self.Atools.backproj(np.multiply(multHuber,res))
+                        grad_fidelity = Atools.backproj(res)
                 elif (_data_['studentst_threshold'] is not None):
                     # apply Students't penalty
-                    multStudent = np.ones(np.shape(res))
-                    multStudent = np.divide(2.0, _data_['studentst_threshold']**2 + res**2)
+                    multStudent = xp.ones(res.shape)
+                    multStudent = xp.divide(2.0, _data_['studentst_threshold']**2 + res**2)
                     if (_data_['OS_number'] != 1):
                         # OS-Students't-gradient
-                        grad_fidelity = self.AtoolsOS.backprojOS(np.multiply(multStudent,res), sub_ind)
+                        grad_fidelity = self.AtoolsOS.backprojOS(xp.multiply(multStudent,res), sub_ind)
                     else:
                         # full Students't gradient
-                        grad_fidelity = self.Atools.backproj(np.multiply(multStudent,res))
+                        grad_fidelity = Atools.backproj(xp.multiply(multStudent,res))
                 else:
                     if (_data_['OS_number'] != 1):
                         # OS reduced gradient
                         grad_fidelity = self.AtoolsOS.backprojOS(res, sub_ind)
                     else:
                         # full gradient
-                        grad_fidelity = self.Atools.backproj(res)
+                        grad_fidelity = Atools.backproj(res)
 
-                X = X_t - L_const_inv*grad_fidelity
-                if (_algorithm_['nonnegativity'] == 'ENABLE'):
-                    X[X < 0.0] = 0.0
+                X = gradient_step(X_t, grad_fidelity, L_const_inv, _algorithm_['nonnegativity'])
                 if (_regularisation_['method'] is not None):
                     ##### The proximal operator of the chosen regulariser #####
-                    (X,info_vec) = prox_regul(self, X, _regularisation_)
+                    (X,info_vec) = regul(X)
                     ###########################################################
-                t = (1.0 + np.sqrt(1.0 + 4.0*t**2))*0.5; # updating t variable
-                X_t = X + ((t_old - 1.0)/t)*(X - X_old) # updating X
+                if (_algorithm_['restart'] == 'gradient'):
+                    # gradient restart (O'Donoghue and Candes): the momentum is reset, the test
+                    # is kept on the device for CuPy data (t becomes a 0-d array, no host synchronisation)
+                    restart = restart_product(X_t, X, X_old, restart_buffers) > 0.0
+                    t_old = xp.where(restart, np.float32(1.0), t_old)
+                    t = xp.where(restart, np.float32(1.0), t)
+                t = (1.0 + xp.sqrt(1.0 + 4.0*t**2))*0.5; # updating t variable
+                X_t = momentum_step(X, X_old, (t_old - 1.0)/t) # updating X
             if ((_data_['ringGH_lambda'] is not None) and (iter > 0)):
-                r = np.maximum((np.abs(r) - _data_['ringGH_lambda']), 0.0)*np.sign(r) # soft-thresholding operator for ring vector
+                r = xp.maximum((xp.abs(r) - _data_['ringGH_lambda']), 0.0)*xp.sign(r) # soft-thresholding operator for ring vector
                 r_x = r + ((t_old - 1.0)/t)*(r - r_old) # updating r
             if (_algorithm_['verbose'] == 'on'):
                 if (np.mod(iter,(round)(_algorithm_['iterations']/5)+1) == 0):
@@ -569,7 +703,7 @@ class RecToolsIR:
                     print('FISTA stopped at iteration (', iter+1, ')')
             # stopping criteria (checked only after a reasonable number of iterations)
             if (((iter > 10) and (_data_['OS_number'] > 1)) or ((iter > 150) and (_data_['OS_number'] == 1))):
-                nrm = LA.norm(X - X_old)*denomN
+                nrm = xp.linalg.norm(X - X_old)*denomN
                 if (nrm < _algorithm_['tolerance']):
                     if (_algorithm_['verbose'] == 'on'):
                         print('FISTA stopped at iteration (', iter+1, ')')
@@ -602,6 +736,7 @@ class RecToolsIR:
             X = np.zeros(rec_dim, 'float32')
 
         info_vec = (0,2)
+        regul = regul_function(self, _regularisation_) # the proximal operator with all parameters bound
         denomN = 1.0/np.size(X)
         z = np.zeros(rec_dim, 'float32')
         u = np.zeros(rec_dim, 'float32')
@@ -627,7 +762,7 @@ class RecToolsIR:
             # Apply regularisation using CCPi-RGL toolkit. The proximal operator of the chosen regulariser
             if (_regularisation_['method'] is not None):
                 # The proximal operator of the chosen regulariser
-                (z,info_vec) = prox_regul(self, x_prox_reg, _regularisation_)
+                (z,info_vec) = regul(x_prox_reg)
             z = z.ravel()
             # update u variable
             u = u + (x_hat - z)
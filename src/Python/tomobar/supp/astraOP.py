@@ -5,6 +5,7 @@ A class based on using ASTRA toolbox to perform projection/bakprojection of 2D/3
 data using parallel beam geometry 
 - SIRT algorithm from ASTRA 
 - CGLS algorithm from ASTRA 
+- FBP for 3D data (custom filtration + 3D backprojection)
 
 GPLv3 license (ASTRA toolbox)
 @author: Daniil Kazantsev: https://github.com/dkazanc
@@ -12,6 +13,14 @@ GPLv3 license (ASTRA toolbox)
 
 import astra
 import numpy as np
+from tomobar.supp.suppTools import bit_reversal_order, filtersinc, filtersinc_rfft
+
+try:
+    import cupy as cp
+    import astra.experimental
+    cupy_enabled = True
+except ImportError:
+    cupy_enabled = False
 
 #define 3D vector geometry
 def rotation_matrix(theta):
@@ -38,6 +47,38 @@ def vec_geom_init(angles_rad, DetectorSpacingX, DetectorSpacingY, CenterRotOffse
         vectors[i,9:12] = vec_temp[:] # Vector from detector pixel (0,0) to (1,0)
     return vectors
 
+def cupy_link(array):
+    """ASTRA link to the device memory of a C-contiguous float32 CuPy 3D array"""
+    [Z, Y, X] = array.shape
+    return astra.data3d.GPULink(array.data.ptr, X, Y, Z, X*array.itemsize)
+
+def direct_projector(proj_id, object3D, vol_shape, sino_shape, operation):
+    """
+    Forward ('FP') or backward ('BP') projection of a CuPy array directly on the
+    device, 2D arrays are treated as single slice 3D volumes/sinograms. The rows
+    of 2D ASTRA images run from the top (max Y) down, while the rows of 3D volumes
+    run from min Y up, therefore 2D images are flipped at the projector boundary
+    to give the same orientation as the 2D (NumPy) projectors
+    """
+    flip2D = (object3D.ndim == 2)
+    if (operation == 'FP'):
+        if (flip2D):
+            object3D = object3D[::-1,:]
+        vol_data = cp.ascontiguousarray(object3D.reshape(vol_shape), dtype=cp.float32)
+        proj_data = cp.zeros(sino_shape, dtype=cp.float32)
+        astra.experimental.direct_FP3D(proj_id, cupy_link(vol_data), cupy_link(proj_data))
+        output = proj_data
+    else:
+        proj_data = cp.ascontiguousarray(object3D.reshape(sino_shape), dtype=cp.float32)
+        vol_data = cp.zeros(vol_shape, dtype=cp.float32)
+        astra.experimental.direct_BP3D(proj_id, cupy_link(vol_data), cupy_link(proj_data))
+        if (flip2D):
+            return cp.ascontiguousarray(vol_data[0,::-1,:])
+        output = vol_data
+    if (flip2D):
+        return output[0,:,:]
+    return output
+
 class AstraTools:
     """2D parallel beam projection/backprojection class based on ASTRA toolbox"""
     def __init__(self, DetectorsDim, AnglesVec, ObjSize, device):
@@ -61,12 +102,10 @@ class AstraTools:
         """Applying forward projection"""
         sinogram_id, sinogram = astra.create_sino(image, self.proj_id)
         astra.data2d.delete(sinogram_id)
-        astra.data2d.delete(self.proj_id)
         return sinogram
     def backproj(self, sinogram):
         """Applying backprojection"""
         rec_id, image = astra.create_backprojection(sinogram, self.proj_id)
-        astra.data2d.delete(self.proj_id)
         astra.data2d.delete(rec_id)
         return image
     def fbp2D(self, sinogram):
@@ -93,7 +132,35 @@ class AstraTools:
         astra.algorithm.delete(alg_id)
         astra.data2d.delete(rec_id)
         astra.data2d.delete(sinogram_id)
-        astra.data2d.delete(self.proj_id)
+        return recFBP
+    def fbp2D_stack(self, sinograms):
+        """perform FBP reconstruction of a stack of sinograms [slices, angles, detectors],
+        the data objects and the algorithm are created once and reused for all slices"""
+        SlicesNum = np.shape(sinograms)[0]
+        recFBP = np.zeros((SlicesNum, self.ObjSize, self.ObjSize), dtype='float32')
+        rec_id = astra.data2d.create( '-vol', self.vol_geom)
+        sinogram_id = astra.data2d.create('-sino', self.proj_geom, 0)
+        
+        if self.device == 1:
+            cfg = astra.astra_dict('FBP')
+            cfg['ProjectorId'] = self.proj_id
+        else:
+            cfg = astra.astra_dict('FBP_CUDA')
+        cfg['ReconstructionDataId'] = rec_id
+        cfg['ProjectionDataId'] = sinogram_id
+        cfg['FilterType'] = 'Ram-Lak'
+        alg_id = astra.algorithm.create(cfg)
+        
+        for i in range(0, SlicesNum):
+            # new sinogram in the same data object, the volume is cleared before each run
+            astra.data2d.store(sinogram_id, sinograms[i,:,:])
+            astra.data2d.store(rec_id, 0)
+            astra.algorithm.run(alg_id)
+            recFBP[i,:,:] = astra.data2d.get_shared(rec_id)
+
+        astra.algorithm.delete(alg_id)
+        astra.data2d.delete(rec_id)
+        astra.data2d.delete(sinogram_id)
         return recFBP
     def sirt2D(self, sinogram, iterations):
         """perform SIRT reconstruction""" 
@@ -118,7 +185,6 @@ class AstraTools:
         astra.algorithm.delete(alg_id)
         astra.data2d.delete(rec_id)
         astra.data2d.delete(sinogram_id)
-        astra.data2d.delete(self.proj_id)
         return recSIRT
     def cgls2D(self, sinogram, iterations):
         """perform CGLS reconstruction""" 
@@ -143,7 +209,6 @@ class AstraTools:
         astra.algorithm.delete(alg_id)
         astra.data2d.delete(rec_id)
         astra.data2d.delete(sinogram_id)
-        astra.data2d.delete(self.proj_id)
         return recCGLS
     
 class AstraToolsOS:
@@ -183,10 +248,13 @@ class AstraToolsOS:
         # create OS-specific ASTRA geometry
         self.proj_geom_OS = {}
         self.proj_id_OS = {}
+        self.indVec_list = [] # OS-specific indices of every subset
+        self.subset_order = bit_reversal_order(OS)
         for sub_ind in range(OS):
             self.indVec = self.newInd_Vec[sub_ind,:] # OS-specific indices
             if (self.indVec[self.NumbProjBins-1] == 0):
                 self.indVec = self.indVec[:-1] #shrink vector size
+            self.indVec_list.append(self.indVec)
             anglesOS = self.AnglesVec[self.indVec] # OS-specific angles
             self.proj_geom_OS[sub_ind] = astra.create_proj_geom('parallel', 1.0, DetectorsDim, anglesOS)
             if self.device == 1:
@@ -198,24 +266,20 @@ class AstraToolsOS:
         """Applying forward projection for a specific subset"""
         sinogram_id, sinogram = astra.create_sino(image, self.proj_id_OS[no_os])
         astra.data2d.delete(sinogram_id)
-        astra.data2d.delete(self.proj_id_OS[no_os])
         return sinogram
     def backprojOS(self, sinogram, no_os):
         """Applying backprojection for a specific subset"""
         rec_id, image = astra.create_backprojection(sinogram, self.proj_id_OS[no_os])
         astra.data2d.delete(rec_id)
-        astra.data2d.delete(self.proj_id_OS[no_os])
         return image
     def forwproj(self, image):
         """Applying forward projection"""
         sinogram_id, sinogram = astra.create_sino(image, self.proj_id)
         astra.data2d.delete(sinogram_id)
-        astra.data2d.delete(self.proj_id)
         return sinogram
     def backproj(self, sinogram):
         """Applying backprojection"""
         rec_id, image = astra.create_backprojection(sinogram, self.proj_id)
-        astra.data2d.delete(self.proj_id)
         astra.data2d.delete(rec_id)
         return image
 
@@ -235,19 +299,44 @@ class AstraTools3D:
             Y=X=ObjSize
             Z=DetRowCount
         self.vol_geom = astra.create_vol_geom(Y,X,Z)
+        self.vol_shape = (Z,Y,X)
+        self.sino_shape = (DetRowCount,np.size(AnglesVec),DetColumnCount)
         self.proj_id = astra.create_projector('cuda3d', self.proj_geom, self.vol_geom) # for GPU
         self.A_optomo = astra.OpTomo(self.proj_id)
         
     def forwproj(self, object3D):
-        """Applying forward projection"""
+        """Applying forward projection (CuPy arrays are projected on the device)"""
+        if (cupy_enabled and isinstance(object3D, cp.ndarray)):
+            return direct_projector(self.proj_id, object3D, self.vol_shape, self.sino_shape, 'FP')
         proj_id, proj_data = astra.create_sino3d_gpu(object3D, self.proj_geom, self.vol_geom)
         astra.data3d.delete(proj_id)
         return proj_data
     def backproj(self, proj_data):
-        """Applying backprojection"""
+        """Applying backprojection (CuPy arrays are backprojected on the device)"""
+        if (cupy_enabled and isinstance(proj_data, cp.ndarray)):
+            return direct_projector(self.proj_id, proj_data, self.vol_shape, self.sino_shape, 'BP')
         rec_id, object3D = astra.create_backprojection3d_gpu(proj_data, self.proj_geom, self.vol_geom)
         astra.data3d.delete(rec_id)
         return object3D
+    def fbp3D(self, sinogram):
+        """
+        perform FBP reconstruction of all slices at once (filtering + 3D backprojection),
+        CuPy sinograms are filtered and backprojected on the device
+        """
+        import astra.experimental
+        sinogram = sinogram.reshape(self.sino_shape)
+        if (cupy_enabled and isinstance(sinogram, cp.ndarray)):
+            f = cp.asarray(filtersinc_rfft(self.sino_shape[2], self.sino_shape[1]))
+            IMG = cp.fft.rfft(cp.asarray(sinogram, dtype=cp.float32), axis=2)
+            IMG *= f
+            filtered = cp.fft.irfft(IMG, n=self.sino_shape[2], axis=2)
+            return direct_projector(self.proj_id, filtered, self.vol_shape, self.sino_shape, 'BP')
+        # the filtered sinogram and the volume are passed to ASTRA directly
+        # as C-contiguous float32 arrays (no intermediate data3d objects)
+        filtered = np.ascontiguousarray(filtersinc(sinogram), dtype=np.float32)
+        recFBP = np.zeros(self.vol_shape, dtype=np.float32)
+        astra.experimental.direct_BP3D(self.proj_id, recFBP, filtered)
+        return recFBP
     def sirt3D(self, sinogram, iterations):
         """perform SIRT reconstruction""" 
         sinogram_id = astra.data3d.create("-sino", self.proj_geom, sinogram)
@@ -307,6 +396,7 @@ class AstraToolsOS3D:
             Y=X=ObjSize
             Z=DetRowCount
         self.vol_geom = astra.create_vol_geom(Y,X,Z)
+        self.vol_shape = (Z,Y,X)
         
         ################ arrange ordered-subsets ################
         import numpy as np
@@ -325,34 +415,51 @@ class AstraToolsOS3D:
         # self.proj_geom = astra.create_proj_geom('parallel3d', 1.0, 1.0, DetRowCount, DetColumnCount, AnglesVec)
         vectors = vec_geom_init(AnglesVec, 1.0, 1.0, CenterRotOffset)
         self.proj_geom = astra.create_proj_geom('parallel3d_vec', DetRowCount, DetColumnCount, vectors)
+        self.sino_shape = (DetRowCount,AnglesTot,DetColumnCount)
+        self.proj_id = astra.create_projector('cuda3d', self.proj_geom, self.vol_geom) # for GPU
         # create OS-specific ASTRA geometry
         self.proj_geom_OS = {}
+        self.proj_id_OS = {}
+        self.sino_shape_OS = {}
+        self.indVec_list = [] # OS-specific indices of every subset
+        self.subset_order = bit_reversal_order(OS)
         for sub_ind in range(OS):
             self.indVec = self.newInd_Vec[sub_ind,:]
             if (self.indVec[self.NumbProjBins-1] == 0):
                 self.indVec = self.indVec[:-1] #shrink vector size
+            self.indVec_list.append(self.indVec)
             anglesOS = AnglesVec[self.indVec] # OS-specific angles
             #self.proj_geom_OS[sub_ind] = astra.create_proj_geom('parallel3d', 1.0, 1.0, DetRowCount, DetColumnCount, anglesOS)
             vectors = vec_geom_init(anglesOS, 1.0, 1.0, CenterRotOffset)
             self.proj_geom_OS[sub_ind] = astra.create_proj_geom('parallel3d_vec', DetRowCount, DetColumnCount, vectors)
+            self.proj_id_OS[sub_ind] = astra.create_projector('cuda3d', self.proj_geom_OS[sub_ind], self.vol_geom) # for GPU
+            self.sino_shape_OS[sub_ind] = (DetRowCount,np.size(self.indVec),DetColumnCount)
 
     def forwproj(self, object3D):
-        """Applying forward projection"""
+        """Applying forward projection (CuPy arrays are projected on the device)"""
+        if (cupy_enabled and isinstance(object3D, cp.ndarray)):
+            return direct_projector(self.proj_id, object3D, self.vol_shape, self.sino_shape, 'FP')
         proj_id, proj_data = astra.create_sino3d_gpu(object3D, self.proj_geom, self.vol_geom)
         astra.data3d.delete(proj_id)
         return proj_data
     def backproj(self, proj_data):
-        """Applying backprojection"""
+        """Applying backprojection (CuPy arrays are backprojected on the device)"""
+        if (cupy_enabled and isinstance(proj_data, cp.ndarray)):
+            return direct_projector(self.proj_id, proj_data, self.vol_shape, self.sino_shape, 'BP')
         rec_id, object3D = astra.create_backprojection3d_gpu(proj_data, self.proj_geom, self.vol_geom)
         astra.data3d.delete(rec_id)
         return object3D
     def forwprojOS(self, object3D, no_os):
         """Applying forward projection to a specific subset"""
+        if (cupy_enabled and isinstance(object3D, cp.ndarray)):
+            return direct_projector(self.proj_id_OS[no_os], object3D, self.vol_shape, self.sino_shape_OS[no_os], 'FP')
         proj_id, proj_data = astra.create_sino3d_gpu(object3D, self.proj_geom_OS[no_os], self.vol_geom)
         astra.data3d.delete(proj_id)
         return proj_data
     def backprojOS(self, proj_data, no_os):
         """Applying back-projection to a specific subset"""
+        if (cupy_enabled and isinstance(proj_data, cp.ndarray)):
+            return direct_projector(self.proj_id_OS[no_os], proj_data, self.vol_shape, self.sino_shape_OS[no_os], 'BP')
         rec_id, object3D = astra.create_backprojection3d_gpu(proj_data, self.proj_geom_OS[no_os], self.vol_geom)
         astra.data3d.delete(rec_id)
         return object3D
\ No newline at end of file
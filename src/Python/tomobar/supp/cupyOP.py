@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GPU kernels (CuPy) used by the iterative methods when the data is kept on the device:
+- fused FISTA gradient step (with nonnegativity)
+- fused FISTA momentum update
+- fused inner product of the FISTA gradient restart test
+- ring model weights (GPU version of the RING_WEIGHTS C-module) and their thresholding
+- Primal-Dual (Chambolle-Pock) TV proximal operator (PD_TV) with the image shape
+  and the parameters compiled into the kernels
+"""
+
+from functools import lru_cache
+import cupy as cp
+
+# X = X_t - L_const_inv*grad_fidelity, negative values are set to zero if nonneg is true
+gradient_step_kernel = cp.ElementwiseKernel(
+    'T x_t, T grad, T invL, bool nonneg',
+    'T x',
+    'x = x_t - invL*grad; if (nonneg && (x < 0)) x = 0;',
+    'fista_gradient_step')
+
+# X_t = X + beta*(X - X_old)
+momentum_kernel = cp.ElementwiseKernel(
+    'T x, T x_old, T beta',
+    'T x_t',
+    'x_t = x + beta*(x - x_old);',
+    'fista_momentum')
+
+# <X_t - X, X - X_old> for the FISTA gradient restart test without intermediate arrays
+restart_product_kernel = cp.ReductionKernel(
+    'T x_t, T x, T x_old',
+    'T product',
+    '(x_t - x)*(x - x_old)',
+    'a + b',
+    'product = a',
+    '0',
+    'fista_restart_product')
+
+# Huber-type weights for the ring model: 1 below the threshold, thr/|w|^power above it
+ring_function_kernel = cp.ElementwiseKernel(
+    'T w, T thr, T power',
+    'T weight',
+    'T absw = fabs(w); weight = (absw > thr) ? thr/pow(absw, power) : (T)1;',
+    'ring_function_weight')
+
+# 1D rank filter of the RING_WEIGHTS C-module along one dimension (dim, stride) of the array,
+# the taps outside of the array take the value of the central pixel (as in the C-module)
+ring_rank_kernel = cp.RawKernel(r"""
+extern "C" __global__ void ring_rank1D(const float *residual, float *out, const long long size, const int dim, const long long stride, const int halfsize, const int rank)
+{
+    const long long index = (long long)blockDim.x*blockIdx.x + threadIdx.x;
+    if (index >= size) return;
+    const int pos = (int)((index/stride) % dim);
+    const float centre = residual[index];
+    /* the value which has exactly rank smaller values in the window (ties are counted) */
+    for (int m = -halfsize; m <= halfsize; m++) {
+        const float a = ((pos + m >= 0) && (pos + m < dim)) ? residual[index + m*stride] : centre;
+        int less = 0;
+        int less_equal = 0;
+        for (int n = -halfsize; n <= halfsize; n++) {
+            const float b = ((pos + n >= 0) && (pos + n < dim)) ? residual[index + n*stride] : centre;
+            less += (b < a);
+            less_equal += (b <= a);
+        }
+        if ((less <= rank) && (rank < less_equal)) {
+            out[index] = a;
+            return;
+        }
+    }
+}
+""", 'ring_rank1D')
+
+def ring_weights_cupy(residual, window_halfsize_detectors, window_halfsize_angles, window_halfsize_projections):
+    """
+    GPU version of RING_WEIGHTS C-module for the residual [angles, detectors] (2D)
+    or [slices, angles, detectors] (3D). The background is estimated with 1D rank
+    filters along each dimension with the same rank and boundary treatment as in
+    the C-module (a single slice is treated as 2D).
+    """
+    residual = cp.ascontiguousarray(residual, dtype=cp.float32)
+    threads = 256
+    blocks = (residual.size + threads - 1)//threads
+    def rank1D(window_halfsize, axis):
+        filtered = cp.empty_like(residual)
+        stride = residual.strides[axis]//residual.itemsize
+        ring_rank_kernel((blocks,), (threads,), (residual, filtered, cp.int64(residual.size), cp.int32(residual.shape[axis]),
+                                                 cp.int64(stride), cp.int32(window_halfsize), cp.int32(window_halfsize-1)))
+        return filtered
+    angles_axis = residual.ndim - 2
+    if (window_halfsize_angles != 0):
+        weights = rank1D(window_halfsize_angles, angles_axis)
+    else:
+        weights = residual.copy()
+    background = []
+    if (window_halfsize_detectors != 0):
+        background.append(rank1D(window_halfsize_detectors, angles_axis+1))
+    if ((residual.ndim == 3) and (residual.shape[0] > 1) and (window_halfsize_projections != 0)):
+        background.append(rank1D(window_halfsize_projections, 0))
+    if (len(background) == 0):
+        return cp.zeros_like(residual)
+    if (len(background) == 1):
+        weights -= background[0]
+    else:
+        weights -= 0.5*(background[0] + background[1])
+    return weights
+
+# PD_TV kernels (the steps of TV_PD in CCPi-RGL), DIMX/DIMY/DIMZ, TAU, SIGMA, LT,
+# METHODTV and NONNEG are set with #define
+PD_TV_kernels = r'''
+extern "C" __global__ void pd_tv_dual(const float *U, float *P1, float *P2, float *P3)
+{
+    const long long index = (long long)blockDim.x*blockIdx.x + threadIdx.x;
+    if (index >= (long long)DIMX*DIMY*DIMZ) return;
+    const int i = index % DIMX;
+    const int j = (index/DIMX) % DIMY;
+    /* dual variable update, the difference is taken backwards at the last index */
+    float p1 = P1[index] + SIGMA*((i == DIMX-1) ? (U[index-1] - U[index]) : (U[index+1] - U[index]));
+    float p2 = P2[index] + SIGMA*((j == DIMY-1) ? (U[index-DIMX] - U[index]) : (U[index+DIMX] - U[index]));
+#if DIMZ > 1
+    const int k = index/((long long)DIMX*DIMY);
+    float p3 = P3[index] + SIGMA*((k == DIMZ-1) ? (U[index-DIMX*DIMY] - U[index]) : (U[index+DIMX*DIMY] - U[index]));
+#else
+    float p3 = 0.0f;
+#endif
+    /* projection: onto the unit ball (isotropic) or of each component (anisotropic) */
+#if METHODTV == 0
+    const float denom = p1*p1 + p2*p2 + p3*p3;
+    if (denom > 1.0f) {
+        const float sq_denom = 1.0f/sqrtf(denom);
+        p1 *= sq_denom;
+        p2 *= sq_denom;
+        p3 *= sq_denom;
+    }
+#else
+    p1 /= fmaxf(fabsf(p1), 1.0f);
+    p2 /= fmaxf(fabsf(p2), 1.0f);
+    p3 /= fmaxf(fabsf(p3), 1.0f);
+#endif
+    P1[index] = p1;
+    P2[index] = p2;
+#if DIMZ > 1
+    P3[index] = p3;
+#endif
+}
+
+extern "C" __global__ void pd_tv_primal(float *U, const float *U0, const float *P1, const float *P2, const float *P3)
+{
+    const long long index = (long long)blockDim.x*blockIdx.x + threadIdx.x;
+    if (index >= (long long)DIMX*DIMY*DIMZ) return;
+    const int i = index % DIMX;
+    const int j = (index/DIMX) % DIMY;
+    /* divergence of the dual variable (P is taken as zero before the first index) */
+    float div = -(P1[index] - ((i > 0) ? P1[index-1] : 0.0f));
+    div -= P2[index] - ((j > 0) ? P2[index-DIMX] : 0.0f);
+#if DIMZ > 1
+    const int k = index/((long long)DIMX*DIMY);
+    div -= P3[index] - ((k > 0) ? P3[index-DIMX*DIMY] : 0.0f);
+#endif
+    float u_old = U[index];
+#if NONNEG
+    if (u_old < 0.0f) u_old = 0.0f;
+#endif
+    const float u = (u_old - TAU*div + LT*U0[index])/(1.0f + LT);
+    U[index] = u + (u - u_old); /* over-relaxation with theta = 1 */
+}
+'''
+
+@lru_cache(maxsize=8)
+def PD_TV_module(shape, regul_param, lipschitz_const, methodTV, nonneg):
+    """PD_TV kernels compiled for the given image shape and parameters (a few recent ones are cached)"""
+    if (len(shape) == 2):
+        shape = (1,) + tuple(shape)
+    [DIMZ, DIMY, DIMX] = shape
+    tau = regul_param*0.1
+    sigma = 1.0/(lipschitz_const*tau)
+    defines = {'DIMX' : '%d' % DIMX,
+               'DIMY' : '%d' % DIMY,
+               'DIMZ' : '%d' % DIMZ,
+               'TAU' : '%.9ef' % tau,
+               'SIGMA' : '%.9ef' % sigma,
+               'LT' : '%.9ef' % (tau/regul_param),
+               'METHODTV' : '%d' % methodTV,
+               'NONNEG' : '%d' % nonneg}
+    code = ''.join('#define {} {}\n'.format(name, value) for name, value in defines.items())
+    return cp.RawModule(code=code + PD_TV_kernels)
+
+def PD_TV_cupy(inputData, regul_param, iterations, tolerance, methodTV, nonneg, lipschitz_const):
+    """
+    Primal-Dual (Chambolle-Pock) Total variation denoising of a CuPy 2D/3D array
+    on the device, the parameters, the update steps and the stopping rule are
+    the same as for PD_TV of CCPi-RGL
+    """
+    module = PD_TV_module(inputData.shape, float(regul_param), float(lipschitz_const), int(methodTV), int(nonneg))
+    dual = module.get_function('pd_tv_dual')
+    primal = module.get_function('pd_tv_primal')
+    U0 = cp.ascontiguousarray(inputData, dtype=cp.float32)
+    U = U0.copy()
+    P1 = cp.zeros_like(U0)
+    P2 = cp.zeros_like(U0)
+    if (U0.ndim == 3):
+        P3 = cp.zeros_like(U0)
+    else:
+        P3 = P1 # not used for 2D images
+    threads = 256
+    blocks = (U0.size + threads - 1)//threads
+    re = 0.0
+    count = 0
+    iter = -1
+    for iter in range(0,iterations):
+        check = ((tolerance != 0.0) and (iter % 5 == 0))
+        if check:
+            U_old = U.copy()
+        dual((blocks,), (threads,), (U, P1, P2, P3))
+        primal((blocks,), (threads,), (U, U0, P1, P2, P3))
+        if check:
+            # U = u + (u - u_old), the stopping rule uses u before the over-relaxation
+            if nonneg:
+                cp.maximum(U_old, 0, out=U_old)
+            delta = 0.5*(U - U_old)
+            re = float(cp.linalg.norm(delta)/cp.linalg.norm(U_old + delta))
+            if (re < tolerance):
+                count += 1
+            if (count > 3):
+                U = U_old + delta
+                break
+    return (U, (iter+1, re))
@@ -4,34 +4,47 @@
 Supplementary data tools:
     normaliser - to normalise the raw data and take the negative log (if needed)
     autocropper - automatically crops the 3D projection data to reduce its size
+    bit_reversal_order - the order to visit the ordered subsets
+    filtersinc - the sinc filter of the 3D FBP (filtersinc_rfft builds it once)
 @author: Daniil Kazantsev: https://github.com/dkazanc
 """
 import numpy as np
 
+try:
+    import cupy as cp
+    cupy_enabled = True
+except ImportError:
+    cupy_enabled = False
+
 def normaliser(data, flats, darks, log):
     """
     data normaliser which assumes data/flats/darks to be in the following format:
     [Projections, detectorsVertical, detectorsHoriz] or 
     [Projections, detectorsHoriz, detectorsVertical]
+    CuPy arrays are normalised on the device (the output is a CuPy array)
     """
-    data_norm = np.zeros(np.shape(data),dtype='float32')
-    [ProjectionsNum, detectorsX, detectorsY]= np.shape(data) # get the number of projection angles
-    flats = np.mean(flats,0) # mean across flats
-    darks = np.mean(darks,0) # mean across darks
+    if (cupy_enabled):
+        xp = cp.get_array_module(data)
+    else:
+        xp = np
+    flats = xp.mean(xp.asarray(flats, dtype=xp.float32),0) # mean across flats
+    darks = xp.mean(xp.asarray(darks, dtype=xp.float32),0) # mean across darks
     denom = (flats-darks)
-    denom[(np.where(denom <= 0.0))] = 1.0 # remove zeros/negatives in the denominator if any
+    denom[denom <= 0.0] = 1.0 # remove zeros/negatives in the denominator if any
     
-    for i in range(0,ProjectionsNum):
-        sliceS = data[i,:,:] # select a stack [detector x slices]
-        nomin = sliceS - darks # get nominator
-        nomin[(np.where(nomin < 0.0))] = 1.0 # remove negatives
-        fraction = np.true_divide(nomin,denom)
-        data_norm[i,:,:] = fraction.astype(float)
+    # all projections at once, the operations are done in place of the float32 copy
+    data_norm = xp.array(data, dtype=xp.float32)
+    data_norm -= darks # get nominator
+    data_norm[data_norm < 0.0] = 1.0 # remove negatives
+    data_norm /= denom
     
     if log is not None:
-        # calculate negative log (avoiding of log(0) (= inf) and > 1.0 (negative val))
-        data_norm[data_norm > 0.0] = -np.log(data_norm[data_norm > 0.0])
-        data_norm[data_norm < 0.0] = 0.0 # remove negative values
+        # calculate negative log (avoiding of log(0) (= inf) and > 1.0 (negative val)),
+        # both are set to 1.0 before the log, so that they become zeros
+        xp.minimum(data_norm, 1.0, out=data_norm)
+        data_norm[data_norm == 0.0] = 1.0
+        xp.log(data_norm, out=data_norm)
+        xp.negative(data_norm, out=data_norm)
         
     return data_norm
 
@@ -116,4 +129,46 @@ def autocropper(data, addbox, backgr_pix1):
     
     # Finally time to crop the data
     cropped_data = data[:,crop_up_vert:crop_down_vert,crop_left_horiz:crop_right_horiz]
-    return cropped_data
\ No newline at end of file
+    return cropped_data
+
+def bit_reversal_order(OS):
+    """
+    The order to visit the subsets: bit-reversed subset numbers, so that
+    consecutive subsets are far apart in angles (OS need not be a power of 2)
+    """
+    bits = max(int(OS - 1).bit_length(), 1)
+    order = [int(format(i, '0{}b'.format(bits))[::-1], 2) for i in range(2**bits)]
+    return [sub_ind for sub_ind in order if sub_ind < OS]
+
+filtersinc_rfft_list = {} # FBP filters built for (detector size, number of projections)
+
+def filtersinc_rfft(DetectorsLengthH, projectionsNum):
+    # builds the FBP filter once for the given detector size and number of projections,
+    # the filter is real and even, it is sampled at the non-negative frequencies of the real FFT
+    if ((DetectorsLengthH, projectionsNum) in filtersinc_rfft_list):
+        return filtersinc_rfft_list[(DetectorsLengthH, projectionsNum)]
+    # adopted from Matlabs code by  Waqas Akram
+    #"a":	This parameter varies the filter magnitude response.
+    #When "a" is very small (a<<1), the response approximates |w|
+    #As "a" is increased, the filter response starts to 
+    #roll off at high frequencies.
+    a = 1.1
+    w = np.float32(2.0*np.pi*np.fft.fftfreq(DetectorsLengthH)) # all FFT frequencies (to scale the filter)
+    rn2 = np.sin(a*w/2.0)
+    rd = (a*w)/2.0
+    scale = (np.dot(rn2, rd)/np.dot(rd, rd))**2 # least squares fit of the sinc term
+    w = np.float32(2.0*np.pi*np.fft.rfftfreq(DetectorsLengthH)) # non-negative frequencies
+    rn1 = np.abs(2.0/a*np.sin(a*w/2.0))
+    multiplier = (1.0/projectionsNum)
+    filtersinc_rfft_list[(DetectorsLengthH, projectionsNum)] = np.float32(multiplier*scale*rn1)
+    return filtersinc_rfft_list[(DetectorsLengthH, projectionsNum)]
+
+def filtersinc(projection3D):
+    # applies filters to __3D projection data__ in order to achieve FBP
+    # Data format [DetectorVert, Projections, DetectorHoriz]
+    [DetectorsLengthV, projectionsNum, DetectorsLengthH] = np.shape(projection3D)
+    f = filtersinc_rfft(DetectorsLengthH, projectionsNum)
+    # filter all projections at once along the horizontal detector dimension
+    IMG = np.fft.rfft(projection3D, axis=2)
+    IMG *= f
+    return np.float32(np.fft.irfft(IMG, n=DetectorsLengthH, axis=2))
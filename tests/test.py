@@ -3,6 +3,369 @@ import numpy as np
 from tomobar.methodsDIR import RecToolsDIR
 from tomobar.methodsIR import RecToolsIR
 
+try:
+    import astra
+    astra_enabled = True
+except Exception:
+    astra_enabled = False
+try:
+    import astra
+    import cupy as cp
+    gpu_enabled = (cp.cuda.runtime.getDeviceCount() > 0)
+except Exception:
+    gpu_enabled = False
+try:
+    from tomobar.supp.addmodules import RING_WEIGHTS
+    ring_enabled = True
+except Exception:
+    ring_enabled = False
+try:
+    from ccpi.filters.regularisers import PD_TV
+    ccpi_enabled = True
+except Exception:
+    ccpi_enabled = False
+
+###############################################################################
+
+def phantom2D(N_size):
+    # an asymmetric test object (flips and rotations change the image)
+    phantom = np.zeros((N_size, N_size), dtype='float32')
+    phantom[N_size//8:N_size//3, N_size//4:3*N_size//4] = 1.0
+    phantom[N_size//2:7*N_size//8, N_size//5:N_size//2] = 0.5
+    return phantom
+
+def filtersinc_loop(projection3D, zero_centred):
+    # the former FBP filtration (a loop over all projections with complex FFTs),
+    # zero_centred samples the response at the FFT frequencies, otherwise
+    # the original linspace grid is used (it has no zero frequency for odd sizes)
+    import scipy.fftpack
+    a = 1.1
+    [DetectorsLengthV, projectionsNum, DetectorsLengthH] = np.shape(projection3D)
+    w =  np.linspace(-np.pi,np.pi-(2*np.pi)/DetectorsLengthH, DetectorsLengthH,dtype='float32')
+    rn1 = np.abs(2.0/a*np.sin(a*w/2.0))
+    rn2 = np.sin(a*w/2.0)
+    rd = (a*w)/2.0
+    rd_c = np.zeros([1,DetectorsLengthH])
+    rd_c[0,:] = rd
+    scale = (np.dot(rn2, np.linalg.pinv(rd_c)))**2
+    if (zero_centred):
+        w = np.float32(2.0*np.pi*np.fft.fftfreq(DetectorsLengthH))
+        rn2 = np.sin(a*w/2.0)
+        rd = (a*w)/2.0
+        scale = (np.dot(rn2, rd)/np.dot(rd, rd))**2
+        f = np.abs(2.0/a*np.sin(a*w/2.0))*scale
+    else:
+        f = scipy.fftpack.fftshift(rn1*scale)
+    multiplier = (1.0/projectionsNum)
+    filtered = np.zeros(np.shape(projection3D))
+    for j in range(0,DetectorsLengthV):
+        for i in range(0,projectionsNum):
+            IMG = scipy.fftpack.fft(projection3D[j,i,:])
+            fimg = IMG*f
+            filtered[j,i,:] = multiplier*np.real(scipy.fftpack.ifft(fimg))
+    return np.float32(filtered)
+
+def pd_tv_steps(inputData, regul_param, iterations, methodTV, nonneg, lipschitz_const):
+    # the steps of PD_TV in CCPi-RGL (2D, without the stopping rule)
+    tau = regul_param*0.1
+    sigma = 1.0/(lipschitz_const*tau)
+    lt = tau/regul_param
+    U = np.float32(inputData.copy())
+    P1 = np.zeros(np.shape(U), dtype='float32')
+    P2 = np.zeros(np.shape(U), dtype='float32')
+    for iter in range(0,iterations):
+        # dual update, the difference is taken backwards at the last index
+        D1 = np.zeros(np.shape(U), dtype='float32')
+        D1[:,:-1] = U[:,1:] - U[:,:-1]
+        D1[:,-1] = U[:,-2] - U[:,-1]
+        D2 = np.zeros(np.shape(U), dtype='float32')
+        D2[:-1,:] = U[1:,:] - U[:-1,:]
+        D2[-1,:] = U[-2,:] - U[-1,:]
+        P1 += sigma*D1
+        P2 += sigma*D2
+        if (nonneg == 1):
+            U[U < 0.0] = 0.0
+        if (methodTV == 0):
+            denom = np.sqrt(np.maximum(P1**2 + P2**2, 1.0))
+            P1 /= denom
+            P2 /= denom
+        else:
+            P1 /= np.maximum(np.abs(P1), 1.0)
+            P2 /= np.maximum(np.abs(P2), 1.0)
+        U_old = U.copy()
+        div = -P1 - P2
+        div[:,1:] += P1[:,:-1]
+        div[1:,:] += P2[:-1,:]
+        U = (U - tau*div + lt*inputData)/(1.0 + lt)
+        U += (U - U_old)
+    return U
+
+def normaliser_loop(data, flats, darks, log):
+    # the former normaliser (a loop over projections)
+    data_norm = np.zeros(np.shape(data),dtype='float32')
+    [ProjectionsNum, detectorsX, detectorsY]= np.shape(data)
+    flats = np.mean(flats,0)
+    darks = np.mean(darks,0)
+    denom = (flats-darks)
+    denom[(np.where(denom <= 0.0))] = 1.0
+    for i in range(0,ProjectionsNum):
+        nomin = data[i,:,:] - darks
+        nomin[(np.where(nomin < 0.0))] = 1.0
+        data_norm[i,:,:] = np.true_divide(nomin,denom)
+    if log is not None:
+        data_norm[data_norm > 0.0] = -np.log(data_norm[data_norm > 0.0])
+        data_norm[data_norm < 0.0] = 0.0
+    return data_norm
+
+def ring_rank_loop(residual, window_halfsize, axis):
+    # the rank filter of the RING_WEIGHTS C-module, the taps outside of the array
+    # take the value of the central pixel
+    dim = residual.shape[axis]
+    positions = np.arange(dim).reshape([dim if (n == axis) else 1 for n in range(residual.ndim)])
+    window = []
+    for m in range(-window_halfsize, window_halfsize+1):
+        shifted = np.take(residual, np.clip(np.arange(dim) + m, 0, dim-1), axis=axis)
+        window.append(np.where((positions + m >= 0) & (positions + m < dim), shifted, residual))
+    return np.sort(np.array(window), axis=0)[window_halfsize-1]
+
+def ring_weights_loop(residual, window_halfsize_detectors, window_halfsize_angles, window_halfsize_projections):
+    # the combinations of the rank filters in the RING_WEIGHTS C-module
+    angles_axis = residual.ndim - 2
+    if ((residual.ndim == 2) or (residual.shape[0] == 1)):
+        if (window_halfsize_angles == 0):
+            return residual - ring_rank_loop(residual, window_halfsize_detectors, angles_axis+1)
+        return ring_rank_loop(residual, window_halfsize_angles, angles_axis) - ring_rank_loop(residual, window_halfsize_detectors, angles_axis+1)
+    proj = lambda: ring_rank_loop(residual, window_halfsize_projections, 0)
+    det = lambda: ring_rank_loop(residual, window_halfsize_detectors, 2)
+    angles = lambda: ring_rank_loop(residual, window_halfsize_angles, 1)
+    if (window_halfsize_angles == 0):
+        if (window_halfsize_detectors == 0):
+            return residual - proj()
+        if (window_halfsize_projections == 0):
+            return residual - det()
+        return residual - 0.5*(proj() + det())
+    if (window_halfsize_detectors == 0):
+        return angles() - proj()
+    if (window_halfsize_projections == 0):
+        return angles() - det()
+    return angles() - 0.5*(proj() + det())
+
+def projections3D(DetectorsLengthH):
+    # box profiles with some noise [DetectorVert, Projections, DetectorHoriz]
+    rng = np.random.RandomState(0)
+    detectors = np.arange(DetectorsLengthH)
+    projection3D = np.zeros((3, 10, DetectorsLengthH), dtype='float32')
+    for j in range(3):
+        for i in range(10):
+            projection3D[j,i,:] = (np.abs(detectors - DetectorsLengthH//2 + i - j) < DetectorsLengthH//4) + 0.1*rng.rand(DetectorsLengthH)
+    return projection3D
+
+class TestFiltersinc(unittest.TestCase):
+    """the vectorised real FFT filtration against the loop over projections"""
+    def test_even_size(self):
+        # the original filter is even for even sizes, the results must be the same
+        from tomobar.methodsDIR import filtersinc
+        for DetectorsLengthH in [32, 64, 128]:
+            projection3D = projections3D(DetectorsLengthH)
+            np.testing.assert_allclose(filtersinc(projection3D), filtersinc_loop(projection3D, False), rtol=1e-4, atol=1e-6)
+
+    def test_odd_size(self):
+        from tomobar.methodsDIR import filtersinc
+        for DetectorsLengthH in [33, 65, 127]:
+            projection3D = projections3D(DetectorsLengthH)
+            np.testing.assert_allclose(filtersinc(projection3D), filtersinc_loop(projection3D, True), rtol=1e-4, atol=1e-6)
+
+class TestNormaliser(unittest.TestCase):
+    """the vectorised normaliser against the loop over projections"""
+    def setUp(self):
+        # zero (data = darks), negative (data < darks) and > 1 (data > flats) ratios,
+        # the first detector column has flats = darks (zero denominator)
+        rng = np.random.RandomState(0)
+        self.darks = np.uint16(100 + rng.randint(0, 10, size=(5, 16, 12)))
+        self.flats = np.uint16(1000 + rng.randint(0, 100, size=(6, 16, 12)))
+        self.flats[:,:,0] = self.darks[0,:,0]
+        self.darks[:,:,0] = self.darks[0,:,0]
+        self.data = np.uint16(rng.randint(50, 1500, size=(20, 16, 12)))
+        self.data[0,:,:] = self.darks[0,:,:]
+
+    def test_ratios(self):
+        from tomobar.supp.suppTools import normaliser
+        data_norm = normaliser(self.data, self.flats, self.darks, None)
+        self.assertTrue((data_norm == 0.0).any() and (data_norm > 1.0).any())
+        np.testing.assert_allclose(data_norm, normaliser_loop(self.data, self.flats, self.darks, None), rtol=1e-5, atol=1e-6)
+
+    def test_log(self):
+        from tomobar.supp.suppTools import normaliser
+        np.testing.assert_allclose(normaliser(self.data, self.flats, self.darks, 'log'),
+                                   normaliser_loop(self.data, self.flats, self.darks, 'log'), rtol=1e-5, atol=1e-6)
+
+class TestBitReversalOrder(unittest.TestCase):
+    """the order to visit the ordered subsets"""
+    def test_permutation(self):
+        from tomobar.supp.suppTools import bit_reversal_order
+        for OS in [1, 6, 10, 12]:
+            self.assertEqual(sorted(bit_reversal_order(OS)), list(range(OS)))
+
+    def test_power_of_two(self):
+        from tomobar.supp.suppTools import bit_reversal_order
+        self.assertEqual(bit_reversal_order(8), [0, 4, 2, 6, 1, 5, 3, 7])
+        self.assertEqual(bit_reversal_order(2), [0, 1])
+
+class TestRestartProduct(unittest.TestCase):
+    """the inner product of the FISTA gradient restart test"""
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        (self.X_t, self.X, self.X_old) = [np.float32(rng.randn(64, 64)) for i in range(3)]
+        self.product = np.vdot(np.float64(self.X_t - self.X), np.float64(self.X - self.X_old))
+
+    def test_numpy(self):
+        from tomobar.methodsIR import restart_product
+        buffers = (np.empty_like(self.X), np.empty_like(self.X))
+        self.assertAlmostEqual(restart_product(self.X_t, self.X, self.X_old, buffers)/self.product, 1.0, places=4)
+
+    @unittest.skipUnless(gpu_enabled, "CuPy with a GPU is required")
+    def test_cupy(self):
+        from tomobar.methodsIR import restart_product
+        product = restart_product(cp.asarray(self.X_t), cp.asarray(self.X), cp.asarray(self.X_old), None)
+        self.assertAlmostEqual(float(product)/self.product, 1.0, places=4)
+
+@unittest.skipUnless(astra_enabled, "ASTRA is required")
+class TestFBPStack(unittest.TestCase):
+    """FBP of a stack of sinograms with the reused ASTRA objects against FBP of each slice"""
+    def setUp(self):
+        self.N_size = 32
+        self.angles_rad = np.linspace(0.0, np.pi, 40, endpoint=False, dtype='float32')
+        RectoolsDIR = RecToolsDIR(DetectorsDimH = self.N_size, DetectorsDimV = None, CenterRotOffset = None,
+                                  AnglesVec = self.angles_rad, ObjSize = self.N_size, device_projector = 'cpu')
+        sinogram = np.float32(RectoolsDIR.FORWPROJ(phantom2D(self.N_size)))
+        self.sinograms = np.stack([sinogram, 2.0*sinogram, np.flipud(sinogram)])
+
+    def test_3D(self):
+        from tomobar.supp.astraOP import AstraTools
+        RectoolsDIR = RecToolsDIR(DetectorsDimH = self.N_size, DetectorsDimV = 3, CenterRotOffset = None,
+                                  AnglesVec = self.angles_rad, ObjSize = self.N_size, device_projector = 'cpu')
+        Atools = AstraTools(self.N_size, self.angles_rad-np.pi, self.N_size, 'cpu')
+        for i in range(3):
+            np.testing.assert_allclose(RectoolsDIR.FBP(self.sinograms)[i,:,:], Atools.fbp2D(np.flipud(self.sinograms[i,:,:])), rtol=1e-6, atol=1e-7)
+
+    def test_2D_stack(self):
+        RectoolsDIR = RecToolsDIR(DetectorsDimH = self.N_size, DetectorsDimV = None, CenterRotOffset = None,
+                                  AnglesVec = self.angles_rad, ObjSize = self.N_size, device_projector = 'cpu')
+        FBP_stack = RectoolsDIR.FBP(self.sinograms)
+        for i in range(3):
+            np.testing.assert_allclose(FBP_stack[i,:,:], RectoolsDIR.FBP(self.sinograms[i,:,:]), rtol=1e-6, atol=1e-7)
+
+@unittest.skipUnless(astra_enabled, "ASTRA is required")
+class TestNonnegativity(unittest.TestCase):
+    """FISTA with the nonnegativity disabled (the regularisers get nonneg = 0)"""
+    def setUp(self):
+        self.N_size = 32
+        self.angles_rad = np.linspace(0.0, np.pi, 40, endpoint=False, dtype='float32')
+        RectoolsDIR = RecToolsDIR(DetectorsDimH = self.N_size, DetectorsDimV = None, CenterRotOffset = None,
+                                  AnglesVec = self.angles_rad, ObjSize = self.N_size, device_projector = 'cpu')
+        self.sinogram = np.float32(RectoolsDIR.FORWPROJ(phantom2D(self.N_size)))
+
+    def rectools(self):
+        return RecToolsIR(DetectorsDimH = self.N_size, DetectorsDimV = None, CenterRotOffset = None,
+                          AnglesVec = self.angles_rad, ObjSize = self.N_size, datafidelity = 'LS',
+                          device_projector = 'cpu')
+
+    def test_disable(self):
+        Rectools = self.rectools()
+        _algorithm_ = {'iterations' : 5, 'nonnegativity' : 'DISABLE', 'verbose' : 'off'}
+        rec = Rectools.FISTA({'projection_norm_data' : self.sinogram}, _algorithm_, {})
+        self.assertEqual(rec.shape, (self.N_size, self.N_size))
+        self.assertEqual(Rectools.nonneg_regul, 0)
+
+    def test_enable_then_disable(self):
+        Rectools = self.rectools()
+        Rectools.FISTA({'projection_norm_data' : self.sinogram}, {'iterations' : 2, 'verbose' : 'off'}, {})
+        self.assertEqual(Rectools.nonneg_regul, 1)
+        Rectools.FISTA({'projection_norm_data' : self.sinogram}, {'iterations' : 2, 'nonnegativity' : 'DISABLE', 'verbose' : 'off'}, {})
+        self.assertEqual(Rectools.nonneg_regul, 0)
+
+@unittest.skipUnless(gpu_enabled, "ASTRA and CuPy with a GPU are required")
+class TestCuPy2D(unittest.TestCase):
+    """the CuPy (3D single slice) path must agree with the NumPy 2D path"""
+    def setUp(self):
+        self.N_size = 64
+        self.angles_rad = np.linspace(0.0, np.pi, 90, endpoint=False, dtype='float32')
+        RectoolsDIR = RecToolsDIR(DetectorsDimH = self.N_size, DetectorsDimV = None, CenterRotOffset = None,
+                                  AnglesVec = self.angles_rad, ObjSize = self.N_size, device_projector = 'gpu')
+        self.sinogram = np.float32(RectoolsDIR.FORWPROJ(phantom2D(self.N_size)))
+
+    def rectools(self):
+        return RecToolsIR(DetectorsDimH = self.N_size, DetectorsDimV = None, CenterRotOffset = None,
+                          AnglesVec = self.angles_rad, ObjSize = self.N_size, datafidelity = 'LS',
+                          device_projector = 'gpu')
+
+    def test_powermethod(self):
+        lc_np = self.rectools().powermethod({'projection_norm_data' : self.sinogram})
+        lc_cp = self.rectools().powermethod({'projection_norm_data' : cp.asarray(self.sinogram)})
+        self.assertAlmostEqual(lc_cp/lc_np, 1.0, delta=0.02)
+
+    def test_FISTA(self):
+        lc = self.rectools().powermethod({'projection_norm_data' : self.sinogram})
+        _algorithm_ = {'iterations' : 30, 'lipschitz_const' : lc, 'verbose' : 'off'}
+        rec_np = self.rectools().FISTA({'projection_norm_data' : self.sinogram}, dict(_algorithm_), {})
+        rec_cp = cp.asnumpy(self.rectools().FISTA({'projection_norm_data' : cp.asarray(self.sinogram)}, dict(_algorithm_), {}))
+        err = np.linalg.norm(rec_cp - rec_np)/np.linalg.norm(rec_np)
+        err_flipped = np.linalg.norm(np.flipud(rec_cp) - rec_np)/np.linalg.norm(rec_np)
+        self.assertLess(err, 0.05)
+        self.assertLess(err, err_flipped)
+
+@unittest.skipUnless(gpu_enabled, "CuPy with a GPU is required")
+class TestRingWeights(unittest.TestCase):
+    """the GPU ring model must give the same weights as the RING_WEIGHTS C-module"""
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.residual2D = np.float32(rng.randn(30, 40))
+        self.residual3D = np.float32(rng.randn(12, 30, 40))
+        self.halfsizes = [(9,7,0), (9,0,0), (9,7,9), (0,7,3), (9,0,3), (0,0,3), (5,3,1)]
+
+    def test_loop(self):
+        from tomobar.supp.cupyOP import ring_weights_cupy
+        for halfsizes in self.halfsizes:
+            for residual in [self.residual2D, self.residual3D, self.residual3D[:1,:,:]]:
+                if ((halfsizes[0] == 0) and ((residual.ndim == 2) or (residual.shape[0] == 1))):
+                    continue # the detectors window is required for 2D
+                np.testing.assert_allclose(cp.asnumpy(ring_weights_cupy(cp.asarray(residual), *halfsizes)),
+                                           ring_weights_loop(residual, *halfsizes), rtol=1e-6, atol=1e-6)
+
+    @unittest.skipUnless(ring_enabled, "RING_WEIGHTS C-module is required")
+    def test_C_module(self):
+        from tomobar.supp.cupyOP import ring_weights_cupy
+        for halfsizes in self.halfsizes:
+            for residual in [self.residual2D, self.residual3D]:
+                if ((halfsizes[0] == 0) and (residual.ndim == 2)):
+                    continue
+                np.testing.assert_allclose(cp.asnumpy(ring_weights_cupy(cp.asarray(residual), *halfsizes)),
+                                           RING_WEIGHTS(residual, *halfsizes), rtol=1e-6, atol=1e-6)
+
+@unittest.skipUnless(gpu_enabled, "CuPy with a GPU is required")
+class TestPD_TV(unittest.TestCase):
+    """PD_TV on the device must follow the steps of PD_TV in CCPi-RGL"""
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.image = phantom2D(64) + np.float32(0.1*rng.randn(64, 64))
+
+    def test_steps(self):
+        from tomobar.supp.cupyOP import PD_TV_cupy
+        for methodTV in [0, 1]:
+            for nonneg in [0, 1]:
+                rec_cp = PD_TV_cupy(cp.asarray(self.image), 0.05, 50, 0.0, methodTV, nonneg, 12.0)[0]
+                rec_np = pd_tv_steps(self.image, 0.05, 50, methodTV, nonneg, 12.0)
+                np.testing.assert_allclose(cp.asnumpy(rec_cp), rec_np, rtol=1e-3, atol=1e-4)
+
+    @unittest.skipUnless(ccpi_enabled, "CCPi-RGL is required")
+    def test_ccpi(self):
+        from tomobar.supp.cupyOP import PD_TV_cupy
+        rec_cp = PD_TV_cupy(cp.asarray(self.image), 0.05, 50, 0.0, 0, 0, 12.0)[0]
+        rec_ccpi = PD_TV(self.image, 0.05, 50, 0.0, 0, 0, 12.0, 'gpu')
+        if isinstance(rec_ccpi, tuple):
+            rec_ccpi = rec_ccpi[0]
+        np.testing.assert_allclose(cp.asnumpy(rec_cp), rec_ccpi, rtol=1e-3, atol=1e-4)
+
 ###############################################################################
 
 if __name__ == '__main__':